@@ -0,0 +1,69 @@
+# Compares BookIndex with the old difflib.get_close_matches lookup.
+# Run from the repo root: python -m benchmarks.bench_book_index
+import random
+import time
+from difflib import get_close_matches
+
+from bot.book_index import BookIndex
+from responses_templates import book_prompts
+
+CONSONANTS = "бвгджзклмнпрстфхцчшщ"
+VOWELS = "аеиоуыэюя"
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    # Pronounceable pseudo-words, so trigram statistics resemble real titles
+    return ["".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 4)))
+            for _ in range(size)]
+
+
+def make_titles(n: int, rng: random.Random):
+    words = make_vocabulary(max(50, n // 5), rng)
+    titles = list(book_prompts.keys())
+    seen = set(titles)
+    while len(titles) < n:
+        title = " ".join(rng.choice(words) for _ in range(rng.randint(2, 5))).capitalize()
+        if title not in seen:
+            seen.add(title)
+            titles.append(title)
+    return titles[:n]
+
+
+def make_queries(titles, count: int, rng: random.Random):
+    queries = []
+    for _ in range(count):
+        title = list(rng.choice(titles).lower())
+        for _ in range(2):  # Two typos per query
+            position = rng.randrange(len(title))
+            title[position] = rng.choice("абвгдеиклмнопрст")
+        queries.append("".join(title))
+    return queries
+
+
+def measure(func, queries):
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'titles':>8} {'build ms':>10} {'index ms/q':>12} {'difflib ms/q':>14}")
+    for n in (10, 1_000, 100_000):
+        titles = make_titles(n, rng)
+        queries = make_queries(titles, 200, rng)
+
+        start = time.perf_counter()
+        index = BookIndex(titles)
+        build = (time.perf_counter() - start) * 1000
+
+        index_ms = measure(lambda q: index.resolve(q), queries)
+        # difflib is far slower on big catalogs, so sample fewer queries there
+        difflib_queries = queries if n <= 1_000 else queries[:3]
+        difflib_ms = measure(lambda q: get_close_matches(q, titles, n=1, cutoff=0.7), difflib_queries)
+        print(f"{n:>8} {build:>10.1f} {index_ms:>12.3f} {difflib_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
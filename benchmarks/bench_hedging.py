@@ -0,0 +1,96 @@
+# Tail latency with and without hedged requests, against stub models with a slow tail.
+# Run from the repo root: python -m benchmarks.bench_hedging --requests 400 --slow-rate 0.05
+import json
+import time
+import asyncio
+import logging
+import argparse
+from contextlib import aclosing
+from typing import Dict, List
+
+from benchmarks.stub_gemini import StubModel, stub_key_pool
+from benchmarks.load_test import summarize
+
+
+def parse_bench_args():
+    parser = argparse.ArgumentParser(description="Hedged request benchmark")
+    parser.add_argument("--requests", type=int, default=400, help="Measured requests per run")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--keys", type=int, default=3, help="Stub API keys")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Median stub latency to the first response")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Log-normal sigma of the stub latency")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of requests that are much slower")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="How much slower those requests are")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub requests that fail")
+    parser.add_argument("--hedge-ratio", type=float, default=0.1, help="Maximum share of hedged requests")
+    parser.add_argument("--stream", action="store_true", help="Measure time to the first streamed chunk")
+    parser.add_argument("--gemini-mode", choices=["async", "thread"], default="async",
+                        help="Call the stub models through the async API or the blocking one in threads")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the stub models")
+    return parser.parse_args()
+
+
+async def run(bench_args, hedge: bool) -> Dict:
+    from bot.gemini_handler import GeminiHandler
+    from bot.key_pool import RESPONSE, FIRST_CHUNK
+
+    models = [StubModel(bench_args.latency_ms, bench_args.jitter, bench_args.slow_rate, bench_args.slow_factor,
+                        bench_args.error_rate, seed=bench_args.seed + index) for index in range(bench_args.keys)]
+    pool = stub_key_pool(models)
+    handler = GeminiHandler([], key_pool=pool, mode=bench_args.gemini_mode, timeout=60, min_timeout=1.0,
+                            executor_workers=4 * bench_args.concurrency, hedge=hedge, hedge_ratio=bench_args.hedge_ratio)
+
+    async def request(index: int) -> float:
+        started = time.perf_counter()
+        if bench_args.stream:
+            async with aclosing(handler.stream_response("Думай и богатей", f"Вопрос {index}")) as stream:
+                async for _ in stream:
+                    break  # Time to the first chunk; closing the stream cancels the rest
+        else:
+            await handler.generate_response("Думай и богатей", f"Вопрос {index}")
+        return time.perf_counter() - started
+
+    async def drive(indices: range) -> List[float]:
+        queue = iter(indices)
+        latencies = []
+
+        async def worker():
+            for index in queue:
+                latencies.append(await request(index))
+
+        await asyncio.gather(*(worker() for _ in range(bench_args.concurrency)))
+        return latencies
+
+    # Percentiles need a few samples per key before timeouts adapt and hedging starts
+    await drive(range(-25 * bench_args.keys, 0))
+    handler.stats.update({"hedged": 0, "hedge_wins": 0, "hedges_skipped": 0})
+    calls_before = sum(model.stats["calls"] for model in models)
+    latencies = await drive(range(bench_args.requests))
+    upstream = sum(model.stats["calls"] for model in models) - calls_before
+
+    handler.close()
+    return {
+        "hedge": hedge,
+        "latency_ms": summarize(latencies),
+        "upstream_requests": upstream,
+        "extra_load": round(upstream / bench_args.requests - 1, 3),
+        "hedged": handler.stats["hedged"],
+        "hedge_wins": handler.stats["hedge_wins"],
+        "hedges_skipped": handler.stats["hedges_skipped"],
+        "timeouts_s": {key.name: round(handler._timeout_for(key, FIRST_CHUNK if bench_args.stream else RESPONSE), 2)
+                       for key in pool.keys},
+    }
+
+
+def main():
+    bench_args = parse_bench_args()
+    logging.basicConfig(level=logging.ERROR)
+    results = {
+        "config": vars(bench_args),
+        "runs": [asyncio.run(run(bench_args, hedge=False)), asyncio.run(run(bench_args, hedge=True))],
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
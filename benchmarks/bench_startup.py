@@ -0,0 +1,126 @@
+# Cold start benchmark: import profile and time from process spawn to the first answered update.
+# Run from the repo root: python -m benchmarks.bench_startup --runs 5
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = ("google.generativeai", "google.ai.generativelanguage", "grpc", "smtplib")
+
+
+def parse_bench_args():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start per measurement")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def import_profile(module: str) -> List[Tuple[str, float]]:
+    # (module, cumulative seconds) as reported by -X importtime
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        if len(name) - len(name.lstrip()) <= 3:  # Root imports and their direct children
+            profile.append((name.strip(), int(parts[1]) / 1e6))
+    return sorted(profile, key=lambda item: item[1], reverse=True)
+
+
+def wall_time(code: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+    return time.perf_counter() - started
+
+
+def first_update_run() -> Dict:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["spawn_to_exit_s"] = time.perf_counter() - started
+    return result
+
+
+async def child():
+    # Runs in a fresh interpreter: boot the bot against a fake Bot API and answer /start
+    started = time.perf_counter()
+    from benchmarks.fake_telegram import FakeTelegramServer
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot.config import parse_args
+    from bot.bootstrap import create_app
+    imported = time.perf_counter()
+
+    workdir = tempfile.mkdtemp(prefix="bot-startup-")
+    server = FakeTelegramServer()
+    base_url = await server.start()
+    args = parse_args(["--telegram-token", "42:FAKE", "--gemini-api-keys", "stub",
+                       "--fsm-db", os.path.join(workdir, "fsm.sqlite"),
+                       "--feedback-path", os.path.join(workdir, "ratings.jsonl")])
+    bot, dp, services = create_app(args, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    built = time.perf_counter()
+
+    user = {"id": 1, "is_bot": False, "first_name": "user"}
+    await dp.feed_raw_update(bot, {"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}, "from": user, "text": "/start"}})
+    answered = time.perf_counter()
+
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    await dp.emit_shutdown()  # Drains handlers and closes the FSM storage
+    await services.close()
+    await bot.session.close()
+    await server.stop()
+    print(json.dumps({
+        "import_s": imported - started,
+        "build_s": built - imported,
+        "first_update_s": answered - built,
+        "in_process_total_s": answered - started,
+        "answered": server.calls["sendMessage"] > 0,
+        "heavy_modules_loaded": loaded,
+    }))
+
+
+def main():
+    bench_args = parse_bench_args()
+    if bench_args.child:
+        asyncio.run(child())
+        return
+
+    interpreter = statistics.median(wall_time("pass") for _ in range(bench_args.runs))
+    bootstrap = statistics.median(wall_time("import bot.bootstrap") for _ in range(bench_args.runs))
+    try:
+        sdk = statistics.median(wall_time("import google.generativeai") for _ in range(bench_args.runs)) - interpreter
+    except subprocess.CalledProcessError:
+        sdk = None  # SDK not installed
+
+    runs = [first_update_run() for _ in range(bench_args.runs)]
+    results = {
+        "interpreter_s": round(interpreter, 4),
+        "import_bootstrap_s": round(bootstrap - interpreter, 4),
+        "gemini_sdk_import_s": round(sdk, 4) if sdk is not None else None,
+        "first_update": {
+            key: round(statistics.median(run[key] for run in runs), 4)
+            for key in ("import_s", "build_s", "first_update_s", "in_process_total_s", "spawn_to_exit_s")
+        },
+        "answered": all(run["answered"] for run in runs),
+        "heavy_modules_loaded": sorted({name for run in runs for name in run["heavy_modules_loaded"]}),
+        "slowest_imports": [(name, round(seconds, 4)) for name, seconds in import_profile("bot.bootstrap")[:bench_args.top]],
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Minimal local stand-in for the Telegram Bot API, enough for the bot's handlers
+import time
+import json
+import asyncio
+import itertools
+from collections import Counter
+from typing import Any, Dict
+
+from aiohttp import web
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "BookBot", "username": "book_bot"}
+
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup"}
+
+
+class FakeTelegramServer:
+    def __init__(self, response_delay: float = 0.0):
+        self.response_delay = response_delay
+        self.message_ids = itertools.count(1)
+        self.calls: Counter = Counter()
+        self.runner = None
+        self.base_url = None
+
+    async def start(self, host: str = "127.0.0.1") -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+        return web.json_response({"ok": True, "result": self.result(method, data)})
+
+    def result(self, method: str, data: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            chat_id = int(data.get("chat_id", 0))
+            message = {
+                "message_id": int(data.get("message_id") or next(self.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": data.get("text", ""),
+            }
+            if data.get("reply_markup"):
+                markup = data["reply_markup"]
+                message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+            return message
+        return True
@@ -0,0 +1,181 @@
+# Offline load test: the real Dispatcher and routers against a fake Bot API and a stub Gemini.
+# Run from the repo root: python -m benchmarks.load_test --sessions 500 --concurrency 50 --output results.json
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+import subprocess
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.fake_telegram import FakeTelegramServer, BOT_USER
+from benchmarks.stub_gemini import StubGeminiHandler
+
+SESSION_STEPS = (
+    ("question", "message", "/question"),
+    ("book", "message", "Думай и богатей"),
+    ("ask", "message", "Как книга объясняет силу убеждений в достижении успеха?"),
+    ("continue", "callback", "continue_book"),
+    ("follow_up", "message", "А если доход нерегулярный?"),
+    ("rate", "callback", "rate_4"),
+    ("add_comment", "callback", "add_comment"),
+    ("comment", "message", "Полезный ответ"),
+)
+
+
+def parse_load_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot")
+    parser.add_argument("--sessions", type=int, default=200, help="Scripted user sessions to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="Sessions running at once")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Median stub Gemini latency")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Log-normal sigma of the stub latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub Gemini calls that fail")
+    parser.add_argument("--telegram-delay-ms", type=float, default=0, help="Fake Bot API response delay")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Generation scheduler limit (default: --concurrency)")
+    parser.add_argument("--edit-interval", type=float, default=0.5, help="Streaming edit cadence in seconds")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file")
+    return parser.parse_args()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[position]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "max": round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_update(update_id: int, user_id: int, kind: str, payload: str, message_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    now = int(time.time())
+    if kind == "message":
+        return {"update_id": update_id, "message": {
+            "message_id": message_id, "date": now, "chat": chat, "from": user, "text": payload}}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": payload,
+        "message": {"message_id": message_id, "date": now, "chat": chat, "from": BOT_USER, "text": "..."}}}
+
+
+async def run(load_args):
+    workdir = tempfile.mkdtemp(prefix="bot-load-")
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot.config import parse_args
+    from bot.bootstrap import create_app
+
+    args = parse_args([
+        "--telegram-token", "42:FAKE", "--gemini-api-keys", "stub",
+        "--fsm-db", os.path.join(workdir, "fsm.sqlite"),
+        "--feedback-path", os.path.join(workdir, "ratings.jsonl"),
+        "--outbox-db", os.path.join(workdir, "outbox.sqlite"),
+        "--stream-edit-interval", str(load_args.edit_interval),
+        "--max-concurrency", str(load_args.max_concurrency or load_args.concurrency),
+        "--max-queue", str(load_args.sessions),
+    ])
+    server = FakeTelegramServer(load_args.telegram_delay_ms / 1000)
+    base_url = await server.start()
+    stub = StubGeminiHandler(load_args.latency_ms, load_args.jitter, load_args.error_rate)
+    bot, dp, services = create_app(args, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)),
+                                   gemini_handler=stub)
+
+    update_ids = itertools.count(1)
+    step_latencies: Dict[str, List[float]] = defaultdict(list)
+    session_latencies: List[float] = []
+    errors = 0
+    pending = iter(range(load_args.sessions))
+
+    async def run_session(user_id: int):
+        nonlocal errors
+        session_start = time.perf_counter()
+        for message_id, (step, kind, payload) in enumerate(SESSION_STEPS, start=1):
+            update = make_update(next(update_ids), user_id, kind, payload, message_id)
+            start = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                errors += 1
+                logging.error(f"Session {user_id} failed at {step}: {e}")
+                return
+            step_latencies[step].append(time.perf_counter() - start)
+        session_latencies.append(time.perf_counter() - session_start)
+
+    async def worker():
+        for index in pending:
+            await run_session(1_000_000 + index)
+
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(load_args.concurrency)))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_kb()
+
+    await dp.emit_shutdown()  # Drains handlers and closes the FSM storage
+    await services.close()
+    await bot.session.close()
+    await server.stop()
+
+    all_steps = [value for values in step_latencies.values() for value in values]
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(load_args),
+        "elapsed_s": round(elapsed, 3),
+        "throughput": {
+            "sessions_per_s": round(len(session_latencies) / elapsed, 2),
+            "updates_per_s": round(len(all_steps) / elapsed, 2),
+        },
+        "latency_ms": {
+            "session": summarize(session_latencies),
+            "update": summarize(all_steps),
+            "steps": {step: summarize(values) for step, values in step_latencies.items()},
+        },
+        "memory_kb": {"rss_before": rss_before, "rss_after": rss_after, "growth": rss_after - rss_before},
+        "telegram_calls": dict(server.calls),
+        "gemini": stub.get_stats(),
+        "errors": errors,
+    }
+
+
+def main():
+    load_args = parse_load_args()
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s")
+    results = asyncio.run(run(load_args))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if load_args.output:
+        with open(load_args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Drop-in replacement for GeminiHandler with configurable latency and error rate
+import time
+import random
+import asyncio
+from typing import AsyncIterator, Dict, Optional
+
+from responses_templates import ERROR_RESPONSE
+
+ANSWER = (
+    "Анализ ситуации: вы хотите применить идеи книги к своей жизни.\n\n"
+    "Ответ на вопрос: начните с малого и откладывайте часть дохода.\n\n"
+    "Обоснование: книга учит платить сначала себе.\n\n"
+    "Цитаты из книги: «Часть всего, что ты зарабатываешь, принадлежит тебе»."
+)
+
+
+class StubGeminiHandler:
+    def __init__(self, latency_ms: float = 800, jitter: float = 0.5, error_rate: float = 0.0,
+                 chunks: int = 5, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter  # Log-normal sigma around the median latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.random = random.Random(seed)
+        self.stats = {"issued": 0, "errors": 0}
+
+    def latency(self) -> float:
+        return self.latency_ms / 1000 * self.random.lognormvariate(0, self.jitter)
+
+    async def generate_response(self, book: str, question: str, history=None) -> str:
+        self.stats["issued"] += 1
+        await asyncio.sleep(self.latency())
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return ERROR_RESPONSE
+        return ANSWER
+
+    async def stream_response(self, book: str, question: str, history=None) -> AsyncIterator[str]:
+        self.stats["issued"] += 1
+        delay = self.latency() / self.chunks
+        if self.random.random() < self.error_rate:
+            await asyncio.sleep(delay * self.chunks)
+            self.stats["errors"] += 1
+            yield ERROR_RESPONSE
+            return
+        size = -(-len(ANSWER) // self.chunks)
+        for start in range(0, len(ANSWER), size):
+            await asyncio.sleep(delay)
+            yield ANSWER[start:start + size]
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+class StubChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+# Stands in for genai.GenerativeModel under GeminiHandler: log-normal latency with
+# occasional much slower requests (the tail hedging is meant to cut)
+class StubModel:
+    def __init__(self, latency_ms: float = 800, jitter: float = 0.3, slow_rate: float = 0.0,
+                 slow_factor: float = 10.0, error_rate: float = 0.0, chunks: int = 5,
+                 chunk_interval: float = 0.01, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.random = random.Random(seed)
+        self.stats = {"calls": 0, "errors": 0, "cancelled": 0}
+
+    def latency(self) -> float:
+        latency = self.latency_ms / 1000 * self.random.lognormvariate(0, self.jitter)
+        if self.random.random() < self.slow_rate:
+            latency *= self.slow_factor
+        return latency
+
+    def _fail(self):
+        from google.api_core import exceptions
+        self.stats["errors"] += 1
+        raise exceptions.ServiceUnavailable("Stub model failure")
+
+    async def generate_content_async(self, contents, stream: bool = False, request_options=None):
+        self.stats["calls"] += 1
+        latency = self.latency()
+        if stream:
+            return self._stream(latency)
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        if self.random.random() < self.error_rate:
+            self._fail()
+        return StubChunk(ANSWER)
+
+    async def _stream(self, first_latency: float):
+        size = -(-len(ANSWER) // self.chunks)
+        try:
+            await asyncio.sleep(first_latency)
+            if self.random.random() < self.error_rate:
+                self._fail()
+            for start in range(0, len(ANSWER), size):
+                yield StubChunk(ANSWER[start:start + size])
+                await asyncio.sleep(self.chunk_interval)
+        except (asyncio.CancelledError, GeneratorExit):
+            self.stats["cancelled"] += 1
+            raise
+
+    def generate_content(self, contents, stream: bool = False, request_options=None):
+        # Blocking counterpart of generate_content_async, used by --gemini-mode thread
+        self.stats["calls"] += 1
+        latency = self.latency()
+        if stream:
+            return self._blocking_stream(latency)
+        time.sleep(latency)
+        if self.random.random() < self.error_rate:
+            self._fail()
+        return StubChunk(ANSWER)
+
+    def _blocking_stream(self, first_latency: float):
+        size = -(-len(ANSWER) // self.chunks)
+        try:
+            time.sleep(first_latency)
+            if self.random.random() < self.error_rate:
+                self._fail()
+            for start in range(0, len(ANSWER), size):
+                yield StubChunk(ANSWER[start:start + size])
+                time.sleep(self.chunk_interval)
+        except GeneratorExit:
+            # A blocking call can't be interrupted; the consumer only drops the iterator
+            self.stats["cancelled"] += 1
+            raise
+
+
+def stub_key_pool(models, rpm: int = 1_000_000):
+    # KeyPool whose keys answer with the given StubModels instead of the Gemini SDK
+    from bot.key_pool import ApiKey, KeyPool
+
+    class StubApiKey(ApiKey):
+        def __init__(self, name: str, model: StubModel):
+            super().__init__(name, "stub", rpm, 10 ** 9)
+            self.stub = model
+
+        def get_model(self, model_name: str, system_instruction: Optional[str] = None):
+            return self.stub
+
+    pool = KeyPool([], "stub", rpm=rpm)
+    pool.keys = [StubApiKey(f"stub-key-{index}", model) for index, model in enumerate(models)]
+    return pool
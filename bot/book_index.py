@@ -0,0 +1,112 @@
+import re
+import math
+import heapq
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "",
+    "э": "e", "ю": "yu", "я": "ya",
+}
+_TRANSLIT = str.maketrans(CYRILLIC_TO_LATIN)
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize(text: str) -> str:
+    # Lowercase, transliterate Cyrillic to Latin and collapse punctuation, so both scripts meet
+    text = text.lower().translate(_TRANSLIT)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Character-trigram inverted index over book titles and their aliases
+class BookIndex:
+    def __init__(self, titles: Iterable[str], aliases: Optional[Dict[str, List[str]]] = None,
+                 accept: float = 0.55, margin: float = 0.1, floor: float = 0.4):
+        self.titles: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.form_titles = array("I")  # Title id per indexed form
+        self.form_sizes = array("I")  # Trigram count per indexed form
+        self.gram_ids: Dict[str, int] = {}
+        self.postings: List[array] = []
+        self.exact: Dict[str, int] = {}
+        self.accept = accept
+        self.margin = margin
+        self.floor = floor
+        aliases = aliases or {}
+        for title in titles:
+            self.add(title, aliases.get(title, []))
+
+    def add(self, title: str, aliases: Iterable[str] = ()):
+        title_id = self.ids.setdefault(title, len(self.titles))
+        if title_id == len(self.titles):
+            self.titles.append(title)
+        for form in {normalize(title), *(normalize(alias) for alias in aliases)}:
+            if not form:
+                continue
+            self.exact.setdefault(form, title_id)
+            form_id = len(self.form_titles)
+            gram_ids = []
+            for gram in trigrams(form):
+                gram_id = self.gram_ids.setdefault(gram, len(self.postings))
+                if gram_id == len(self.postings):
+                    self.postings.append(array("I"))
+                self.postings[gram_id].append(form_id)
+                gram_ids.append(gram_id)
+            self.form_titles.append(title_id)
+            self.form_sizes.append(len(gram_ids))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        form = normalize(query)
+        if not form:
+            return []
+        if form in self.exact:
+            return [(self.titles[self.exact[form]], 1.0)]
+
+        grams = trigrams(form)
+        size = len(grams)
+        shared = Counter()
+        for gram in grams:
+            gram_id = self.gram_ids.get(gram)
+            if gram_id is not None:
+                shared.update(self.postings[gram_id])  # Counted in C
+
+        # Forms sharing fewer trigrams than this can't reach `floor` (Dice >= floor)
+        needed = max(1, math.ceil(self.floor * size / (2 - self.floor)))
+        best: Dict[int, float] = {}
+        for form_id, common in shared.items():
+            if common < needed:
+                continue
+            score = 2 * common / (size + self.form_sizes[form_id])
+            title_id = self.form_titles[form_id]
+            if score > best.get(title_id, 0.0):
+                best[title_id] = score
+        ranked = heapq.nlargest(k, best.items(), key=lambda item: item[1])
+        return [(self.titles[title_id], score) for title_id, score in ranked]
+
+    def resolve(self, query: str, k: int = 5) -> Tuple[Optional[str], List[str]]:
+        # Returns (confident match, None-or-suggestions when ambiguous)
+        ranked = self.search(query, k)
+        if not ranked:
+            return None, []
+        top_title, top_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if top_score >= self.accept and top_score - runner_up >= self.margin:
+            return top_title, []
+        return None, [title for title, score in ranked if score >= self.floor]
+
+    def title_id(self, title: str) -> Optional[int]:
+        return self.ids.get(title)
+
+    def title_by_id(self, title_id: int) -> Optional[str]:
+        return self.titles[title_id] if 0 <= title_id < len(self.titles) else None
+
+    def __len__(self):
+        return len(self.titles)
@@ -0,0 +1,36 @@
+from argparse import Namespace
+from typing import Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from bot.handlers import basic, question
+from bot.middlewares import ErrorHandlerMiddleware, HandlerTasksMiddleware, MetricsMiddleware, TelegramMetricsMiddleware
+from bot.services import Services
+
+
+def create_bot(args: Namespace, session=None) -> Bot:
+    bot = Bot(token=args.telegram_token, session=session)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher(services: Services) -> Dispatcher:
+    # Workflow data: handlers declaring a `services` argument receive the container
+    dp = Dispatcher(storage=services.storage, services=services)
+    # The dispatcher owns the FSM storage and closes it on shutdown; running handlers finish first
+    dp.update.outer_middleware(HandlerTasksMiddleware(services.handler_tasks))
+    dp.shutdown.handlers.insert(0, HandlerObject(callback=services.drain))
+
+    dp.message.middleware(ErrorHandlerMiddleware())
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+
+    dp.include_router(basic.basic_router)
+    dp.include_router(question.question_router)
+    return dp
+
+
+def create_app(args: Namespace, worker_index: int = 0, session=None, **overrides) -> Tuple[Bot, Dispatcher, Services]:
+    services = Services(args, worker_index=worker_index, **overrides)
+    return create_bot(args, session), create_dispatcher(services), services
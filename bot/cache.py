@@ -0,0 +1,161 @@
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Dict
+
+from bot.catalog import get_catalog
+from responses_templates import PROMPT
+
+Key = Tuple[str, str, str, str]  # (book, question, model, version)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def prompt_version(book: str, index_version: str = "") -> str:
+    # Changes whenever PROMPT, the book's hint text in the catalog or the book's retrieval index
+    # changes. Without an index the prompt asks the model to "Find in web", so an answer written
+    # before the book text was added must not outlive it.
+    source = PROMPT + "\x00" + get_catalog().hint(book) + "\x00" + index_version
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+
+# Class to cache generated answers in memory (LRU + TTL) and optionally on disk (SQLite).
+# Answers are keyed by the model that wrote them, so a fallback model's answer is not
+# served for questions routed to the other one.
+class ResponseCache:
+    def __init__(self, ttl: int = 24 * 3600, max_bytes: int = 16 * 1024 * 1024, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[Key, Tuple[float, str]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "disk_hits": 0}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.db = None
+        self.executor = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            # Entries of the old table were keyed without the model and the index version
+            self.db.execute("DROP TABLE IF EXISTS responses")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "book TEXT, question TEXT, model TEXT, version TEXT, index_version TEXT, created REAL, "
+                "response TEXT, PRIMARY KEY (book, question, model, version))"
+            )
+            self.db.commit()
+            # Disk writes run in the background, in order, off the event loop
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="cache")
+
+    def make_key(self, book: str, question: str, model: str, index_version: str = "") -> Key:
+        return book, normalize_question(question), model, prompt_version(book, index_version)
+
+    async def get(self, book: str, question: str, model: str, index_version: str = "") -> Optional[str]:
+        key = self.make_key(book, question, model, index_version)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, response = entry
+                if now - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return response
+                self._remove(key)
+
+        if self.db is not None:
+            row = await asyncio.to_thread(self._read, key)
+            if row and now - row[0] < self.ttl:
+                with self.lock:
+                    self._store(key, row[0], row[1])
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                return row[1]
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, book: str, question: str, model: str, response: str, index_version: str = ""):
+        key = self.make_key(book, question, model, index_version)
+        now = time.time()
+        with self.lock:
+            self._store(key, now, response)
+        if self.executor is not None:
+            self.executor.submit(self._write, key, index_version, now, response)
+
+    def _read(self, key: Key) -> Optional[Tuple[float, str]]:
+        with self.db_lock:
+            return self.db.execute(
+                "SELECT created, response FROM answers WHERE book = ? AND question = ? AND model = ? AND version = ?",
+                key,
+            ).fetchone()
+
+    def _write(self, key: Key, index_version: str, created: float, response: str):
+        book, question, model, version = key
+        try:
+            with self.db_lock:
+                self.db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (book, question, model, version, index_version, created, response))
+                self.db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to write cached answer for {book}: {e}")
+
+    def invalidate_book(self, book: str):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == book]:
+                self._remove(key)
+        if self.db is not None:
+            with self.db_lock:
+                self.db.execute("DELETE FROM answers WHERE book = ?", (book,))
+                self.db.commit()
+        logging.info(f"Cache invalidated for book: {book}")
+
+    def purge_stale_versions(self):
+        # Drop disk entries written with an outdated PROMPT/catalog hint version. Entries of an
+        # older index version are never looked up again and leave with the TTL.
+        if self.db is None:
+            return
+        with self.db_lock:
+            for book, index_version, version in self.db.execute(
+                    "SELECT DISTINCT book, index_version, version FROM answers").fetchall():
+                if version != prompt_version(book, index_version):
+                    self.db.execute("DELETE FROM answers WHERE book = ? AND version = ?", (book, version))
+            self.db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            self.db.commit()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "entries": len(self.entries), "bytes": self.size}
+
+    def _entry_size(self, key: Key, response: str) -> int:
+        return sum(len(part.encode("utf-8")) for part in key) + len(response.encode("utf-8"))
+
+    def _store(self, key: Key, created: float, response: str):
+        if key in self.entries:
+            self._remove(key)
+        size = self._entry_size(key, response)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (created, response)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: Key):
+        _, response = self.entries.pop(key)
+        self.size -= self._entry_size(key, response)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)  # Pending writes first
+            self.executor = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
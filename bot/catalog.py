@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.book_index import BookIndex
+from responses_templates import book_prompts, book_aliases, start_text
+
+PAGE_SIZE = 20
+TITLE_KEY_LENGTH = 16
+# Catalogs this large take milliseconds per fuzzy lookup (about 20 ms at 100k titles)
+OFFLOAD_SEARCH_TITLES = 10_000
+
+
+def title_key(title: str) -> str:
+    # Stable id for callback data: positions change when the catalog is reloaded, hashes don't.
+    # Titles themselves can exceed Telegram's 64-byte callback limit.
+    return hashlib.sha1(title.encode("utf-8")).hexdigest()[:TITLE_KEY_LENGTH]
+
+
+LIST_HEADERS = {
+    "start": start_text + "\n📚 Доступные книги:\n\n",
+    "question": "Введите название книги:\n\nНапример:\n",
+}
+
+
+# Immutable view of the catalog; reloads swap in a new one
+class CatalogSnapshot:
+    def __init__(self, books: Dict[str, str], aliases: Dict[str, List[str]], tiers: Optional[Dict[str, str]] = None):
+        self.books = books
+        self.aliases = aliases
+        self.tiers = tiers or {}
+        self.index = BookIndex(books.keys(), aliases)
+        self.keys = {title_key(title): title for title in books}
+        self.titles = list(books.keys())
+        self.page_count = max(1, -(-len(self.titles) // PAGE_SIZE))
+        self.rendered: Dict[Tuple[str, int], str] = {}
+
+    def page_text(self, kind: str, page: int) -> str:
+        # Rendered once per (kind, page) and reused for every message
+        key = (kind, page)
+        if key not in self.rendered:
+            titles = self.titles[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+            text = LIST_HEADERS[kind] + "\n".join(f"- {book}" for book in titles)
+            if self.page_count > 1:
+                text += f"\n\nСтраница {page + 1} из {self.page_count}"
+            self.rendered[key] = text
+        return self.rendered[key]
+
+
+# Book catalog loaded from a JSON/YAML file, reloaded when the file changes
+class BookCatalog:
+    def __init__(self, path: Optional[str] = None, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.next_check = 0.0
+        self.mtime = None
+        self.reloading: Optional[asyncio.Future] = None
+        self.snapshot = self._load()
+
+    @property
+    def current(self) -> CatalogSnapshot:
+        self.maybe_reload()
+        return self.snapshot
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if self.path is None or now < self.next_check or self.reloading is not None:
+            return
+        self.next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._reload()  # No event loop (startup, scripts): nothing to stall
+            return
+        # Parsing and indexing a big catalog takes seconds; updates keep using the old snapshot meanwhile
+        self.reloading = loop.run_in_executor(None, self._reload)
+        self.reloading.add_done_callback(lambda _: setattr(self, "reloading", None))
+
+    def _reload(self):
+        try:
+            self.snapshot = self._load()
+            logging.info(f"Book catalog reloaded: {len(self.snapshot.titles)} books")
+        except Exception as e:
+            logging.exception(f"Failed to reload book catalog, keeping the previous one: {e}")
+
+    def _load(self) -> CatalogSnapshot:
+        if self.path is None:
+            return CatalogSnapshot(dict(book_prompts), book_aliases)
+
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as file:
+            if self.path.endswith((".yaml", ".yml")):
+                import yaml  # Optional dependency, only needed for YAML catalogs
+                entries = yaml.safe_load(file)
+            else:
+                entries = json.load(file)
+
+        # [{"title": ..., "hint": ..., "aliases": [...], "model": "fast" | "thinking" | "auto"}, ...]
+        books, aliases, tiers = {}, {}, {}
+        for entry in entries:
+            books[entry["title"]] = entry.get("hint", "")
+            aliases[entry["title"]] = entry.get("aliases", [])
+            if entry.get("model"):
+                tiers[entry["title"]] = entry["model"]
+        snapshot = CatalogSnapshot(books, aliases, tiers)
+        # Recorded only once the file parsed, so a broken version is retried until it is fixed
+        self.mtime = mtime
+        return snapshot
+
+    async def resolve(self, query: str) -> Tuple[Optional[str], List[str]]:
+        # Fuzzy title lookup; searches over a large catalog run in a thread, off the event loop
+        index = self.current.index
+        if len(index) >= OFFLOAD_SEARCH_TITLES:
+            return await asyncio.to_thread(index.resolve, query)
+        return index.resolve(query)
+
+    def title_by_key(self, key: str) -> Optional[str]:
+        return self.current.keys.get(key)
+
+    def hint(self, book: str) -> str:
+        return self.current.books.get(book, "")
+
+    def model_tier(self, book: str) -> str:
+        # Model tier pinned for the book; "auto" lets the router decide per question
+        return self.current.tiers.get(book, "auto")
+
+    def __contains__(self, book: str) -> bool:
+        return book in self.current.books
+
+    def page_text(self, kind: str, page: int = 0) -> str:
+        return self.current.page_text(kind, page)
+
+    def page_buttons(self, kind: str, page: int = 0) -> List[List[InlineKeyboardButton]]:
+        snapshot = self.current
+        if snapshot.page_count == 1:
+            return []
+        row = []
+        if page > 0:
+            row.append(InlineKeyboardButton(text="◀️", callback_data=f"books_{kind}_{page - 1}"))
+        if page < snapshot.page_count - 1:
+            row.append(InlineKeyboardButton(text="▶️", callback_data=f"books_{kind}_{page + 1}"))
+        return [row]
+
+    def page_keyboard(self, kind: str, page: int = 0) -> Optional[InlineKeyboardMarkup]:
+        buttons = self.page_buttons(kind, page)
+        return InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+
+_catalog: Optional[BookCatalog] = None
+
+
+def get_catalog() -> BookCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = BookCatalog()
+    return _catalog
+
+
+def set_catalog(catalog: BookCatalog):
+    global _catalog
+    _catalog = catalog
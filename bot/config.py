@@ -1,6 +1,6 @@
 import argparse
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Telegram bot settings")
     parser.add_argument('--telegram-token', type=str, required=True, help="Telegram API token")
     parser.add_argument('--gemini-api-keys', nargs='+', required=True, help="List of Gemini API keys")
@@ -9,9 +9,79 @@ def parse_args():
     parser.add_argument('--gmail-app-password', type=str, required=False, help="Your app_password")
     parser.add_argument('--receivers-email', type=str, required=False, help="Receiver's email")
 
-    args = parser.parse_args()
+    parser.add_argument('--cache-db', type=str, required=False, help="SQLite file for the persistent answer cache")
+    parser.add_argument('--cache-ttl', type=int, default=24 * 3600, help="Answer cache TTL in seconds")
+    parser.add_argument('--cache-max-bytes', type=int, default=16 * 1024 * 1024, help="In-memory answer cache size limit in bytes")
+
+    parser.add_argument('--fast-model', type=str, default="gemini-2.0-flash", help="Model for simple questions and fallback under load")
+    parser.add_argument('--thinking-model', type=str, default="gemini-2.0-flash-thinking-exp-01-21", help="Model for questions that need reasoning")
+    parser.add_argument('--model-routing', choices=["auto", "fast", "thinking"], default="auto", help="Pick the model per question, or always use one")
+    parser.add_argument('--thinking-min-chars', type=int, default=300, help="Questions at least this long count as complex")
+    parser.add_argument('--thinking-max-utilization', type=float, default=0.8, help="Per-minute quota share above which thinking model keys count as saturated")
+    parser.add_argument('--thinking-max-wait', type=float, default=2.0, help="Seconds to wait for a thinking model key before falling back to the fast model")
+    parser.add_argument('--thinking-rpm', type=int, required=False, help="Requests per minute for each key on the thinking model (default: --gemini-rpm)")
+
+    parser.add_argument('--gemini-rpm', type=int, default=10, help="Requests per minute allowed for each Gemini API key")
+    parser.add_argument('--gemini-tpm', type=int, default=1_000_000, help="Tokens per minute allowed for each Gemini API key")
+    parser.add_argument('--key-strategy', choices=["least-loaded", "round-robin"], default="least-loaded", help="How API keys are picked from the pool")
+
+    parser.add_argument('--max-concurrency', type=int, required=False, help="Concurrent Gemini generations (default: 2 per API key)")
+    parser.add_argument('--max-queue', type=int, default=100, help="Questions allowed to wait for a free generation slot")
+    parser.add_argument('--queue-position-interval', type=float, default=5.0, help="Seconds between updates of a queued user's position")
+
+    parser.add_argument('--history-tokens', type=int, default=1500, help="Token budget for earlier turns sent with follow-up questions")
+
+    parser.add_argument('--stream-edit-interval', type=float, default=1.5, help="Minimum seconds between progressive answer edits")
+
+    parser.add_argument('--gemini-mode', choices=["async", "thread"], default="async", help="Native async client or blocking calls on a dedicated executor")
+    parser.add_argument('--gemini-timeout', type=float, default=120.0, help="Per-request Gemini timeout in seconds")
+    parser.add_argument('--min-timeout', type=float, default=10.0, help="Lower bound for the adaptive per-key timeout in seconds")
+    parser.add_argument('--timeout-factor', type=float, default=3.0, help="Adaptive per-key timeout as a multiple of the key's p99 latency")
+    parser.add_argument('--hedge', action='store_true', help="Send a duplicate request to a second key when the first is slower than its p95")
+    parser.add_argument('--hedge-ratio', type=float, default=0.1, help="Maximum share of requests that may be hedged")
+    parser.add_argument('--executor-workers', type=int, default=8, help="Executor size for --gemini-mode thread")
+
+    parser.add_argument('--rate-limit-db', type=str, required=False, help="SQLite file shared by bot processes for rate limits")
+
+    parser.add_argument('--fsm-db', type=str, default="fsm.sqlite", help="SQLite file for conversation state")
+    parser.add_argument('--fsm-ttl', type=int, default=3600, help="Seconds an idle conversation stays in memory")
+    parser.add_argument('--fsm-max-sessions', type=int, default=10_000, help="Conversations kept in memory at most")
+
+    parser.add_argument('--feedback-path', type=str, default="ratings.jsonl", help="JSONL file for ratings and comments")
+
+    parser.add_argument('--outbox-db', type=str, default="outbox.sqlite", help="SQLite file for pending feedback emails")
+    parser.add_argument('--email-digest-size', type=int, default=1, help="Feedback comments batched into one email")
+    parser.add_argument('--email-digest-minutes', type=float, default=0, help="Send a partial digest once its oldest comment is this old (0: wait for a full digest)")
+
+    parser.add_argument('--books-dir', type=str, required=False, help="Directory with '<book title>.txt' files used as answer context")
+    parser.add_argument('--index-dir', type=str, default="index", help="Directory for the retrieval index")
+    parser.add_argument('--context-passages', type=int, default=5, help="Passages inserted into the prompt context")
+    parser.add_argument('--context-tokens', type=int, default=1500, help="Token budget for the prompt context")
+
+    parser.add_argument('--catalog', type=str, required=False, help="JSON/YAML book catalog, reloaded on change (default: responses_templates)")
+
+    parser.add_argument('--mode', choices=["polling", "webhook"], default="polling", help="How updates are received")
+    parser.add_argument('--webhook-url', type=str, required=False, help="Public base URL Telegram sends updates to")
+    parser.add_argument('--webhook-path', type=str, default="/webhook", help="URL path of the webhook endpoint")
+    parser.add_argument('--webhook-secret', type=str, required=False, help="Secret token Telegram sends with each update")
+    parser.add_argument('--host', type=str, default="0.0.0.0", help="Webhook server host")
+    parser.add_argument('--port', type=int, default=8080, help="Webhook server port")
+    parser.add_argument('--shutdown-timeout', type=float, default=30.0, help="Seconds running handlers get to finish on shutdown before they are cancelled")
+    parser.add_argument('--workers', type=int, default=1, help="Webhook worker processes sharing the port (SO_REUSEPORT); Gemini quotas are split between them")
+
+    parser.add_argument('--metrics-port', type=int, required=False, help="Serve Prometheus metrics on this port (worker N uses port + N)")
+    parser.add_argument('--metrics-host', type=str, default="127.0.0.1", help="Metrics endpoint host")
+
+    args = parser.parse_args(argv)
 
     if not args.telegram_token or not all(args.gemini_api_keys):
         raise ValueError("Invalid API keys or token provided")
 
+    if args.mode == "webhook" and not (args.webhook_url and args.webhook_secret):
+        raise ValueError("--mode webhook requires --webhook-url and --webhook-secret")
+
+    # Worker processes must share rate limits through SQLite
+    if args.workers > 1 and not args.rate_limit_db:
+        args.rate_limit_db = "rate_limits.sqlite"
+
     return args
@@ -0,0 +1,74 @@
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from responses_templates import SUMMARY_PROMPT, SUMMARY_ACK
+
+# Characters of an older turn kept in the running summary
+DIGEST_QUESTION_CHARS = 200
+DIGEST_ANSWER_CHARS = 300
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit] + "…"
+
+
+# Follow-up conversation about one book, kept in the FSM data under a token budget.
+# Once the budget is exceeded, the oldest turns are folded into a short running summary.
+class Conversation:
+    def __init__(self, summary: str = "", turns: Optional[List[List[str]]] = None, max_tokens: int = 1500):
+        self.summary = summary
+        self.turns = turns or []
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_data(cls, data: Optional[Dict[str, Any]], max_tokens: int = 1500) -> "Conversation":
+        data = data or {}
+        return cls(data.get("summary", ""), [list(turn) for turn in data.get("turns", [])], max_tokens)
+
+    def to_data(self) -> Dict[str, Any]:
+        return {"summary": self.summary, "turns": self.turns}
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns)
+
+    def fingerprint(self) -> str:
+        # Distinguishes identical questions asked with different histories
+        return hashlib.sha1(json.dumps(self.to_data(), ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+    def add(self, question: str, answer: str):
+        # One answer may use at most half of the budget (about 4 characters per token)
+        self.turns.append([question, shorten(answer, self.max_tokens * 2)])
+        self.compact()
+
+    def compact(self):
+        # The latest turn always stays verbatim
+        while self.tokens() > self.max_tokens and len(self.turns) > 1:
+            question, answer = self.turns.pop(0)
+            line = f"- {shorten(question, DIGEST_QUESTION_CHARS)} — {shorten(answer, DIGEST_ANSWER_CHARS)}"
+            self.summary = f"{self.summary}\n{line}" if self.summary else line
+        # The summary gets a third of the budget; its oldest lines go first
+        while estimate_tokens(self.summary) > self.max_tokens // 3 and "\n" in self.summary:
+            self.summary = self.summary.split("\n", 1)[1]
+
+    def contents(self) -> List[Dict[str, Any]]:
+        # Earlier turns in the Gemini chat format; the caller appends the new question
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [SUMMARY_PROMPT.format(summary=self.summary)]})
+            contents.append({"role": "model", "parts": [SUMMARY_ACK]})
+        for question, answer in self.turns:
+            contents.append({"role": "user", "parts": [question]})
+            contents.append({"role": "model", "parts": [answer]})
+        return contents
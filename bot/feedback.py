@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bot.metrics import span
+
+_STOP = object()
+
+
+# Append-only JSONL feedback log written in batches by a background task
+class FeedbackStore:
+    def __init__(self, path: str = "ratings.jsonl", batch_size: int = 100, flush_interval: float = 1.0,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 10, rotate: bool = True):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # Webhook workers append to one shared file; only one of them may rotate it
+        self.rotate = rotate
+        self.queue: Optional[asyncio.Queue] = None
+        self.writer: Optional[asyncio.Task] = None
+        self.stats = {"submitted": 0, "written": 0, "rotations": 0}
+
+    def submit(self, record: Dict[str, Any]):
+        if self.writer is None:
+            self.queue = asyncio.Queue()
+            self.writer = asyncio.create_task(self._write_loop())
+        self.queue.put_nowait({"ts": time.time(), **record})
+        self.stats["submitted"] += 1
+
+    async def close(self):
+        # Drain everything queued so far, then stop the writer
+        if self.writer is None:
+            return
+        self.queue.put_nowait(_STOP)
+        await self.writer
+        self.writer = None
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            while not self.queue.empty() and len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+                while not self.queue.empty():
+                    record = self.queue.get_nowait()
+                    if record is not _STOP:
+                        batch.append(record)
+            try:
+                await asyncio.to_thread(self._append, batch)
+            except Exception as e:
+                logging.exception(f"Failed to write {len(batch)} feedback records: {e}")
+
+    def _append(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+        # One write(2) on an O_APPEND descriptor, so batches from several webhook workers never interleave
+        with span("feedback_write"):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = os.write(fd, data)
+                while written < len(data):  # Short writes only happen when the disk is full
+                    written += os.write(fd, data[written:])
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        self.stats["written"] += len(batch)
+        if self.rotate and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        # ratings.jsonl -> ratings.jsonl.1 -> ... -> ratings.jsonl.<backup_count>
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.stats["rotations"] += 1
+        logging.info(f"Feedback log rotated: {self.path}")
+
+    def files(self) -> List[str]:
+        # Oldest first
+        rotated = [f"{self.path}.{index}" for index in range(self.backup_count, 0, -1)]
+        return [path for path in rotated + [self.path] if os.path.exists(path)]
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        for path in self.files():
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipping malformed feedback line in {path}")
+
+    def average_rating_per_book(self) -> Dict[str, Tuple[float, int]]:
+        totals: Dict[str, List[int]] = {}
+        for record in self.iter_records():
+            rating = record.get("rating")
+            if isinstance(rating, int):
+                total = totals.setdefault(record.get("book"), [0, 0])
+                total[0] += rating
+                total[1] += 1
+        return {book: (total / count, count) for book, (total, count) in totals.items()}
+
+    def worst_rated_questions(self, n: int = 10, book: Optional[str] = None) -> List[Dict[str, Any]]:
+        rated = (
+            record for record in self.iter_records()
+            if isinstance(record.get("rating"), int) and (book is None or record.get("book") == book)
+        )
+        return heapq.nsmallest(n, rated, key=lambda record: (record["rating"], -record.get("ts", 0)))
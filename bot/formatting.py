@@ -0,0 +1,170 @@
+import re
+from html import escape, unescape
+from typing import List, Tuple
+
+# Telegram's limit is 4096 UTF-16 code units of visible text per message
+MAX_MESSAGE_LENGTH = 4096
+
+_FENCE = re.compile(r"^\s*```")
+_HEADER = re.compile(r"^\s*#{1,6}\s+(.*?)(?:\s+#+)?\s*$")  # An optional closing "###" is dropped
+_BULLET = re.compile(r"^(\s*)[*+-]\s+(.*)$")
+# Underscore emphasis needs non-word characters around it, and `__name__` with a bare lowercase
+# ASCII name stays literal: in model answers that is almost always a Python identifier
+_INLINE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*\*(?![\s*])(?P<bold_italic>.+?)(?<![\s*])\*\*\*"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|(?<![\w.])__(?![\s_])(?![a-z0-9_]+__(?!\w))(?P<bold2>.+?)(?<![\s_])__(?![\w(])"
+    r"|~~(?P<strike>.+?)~~"
+    r"|(?<![\w*])\*(?![\s*])(?P<italic>.+?)(?<![\s*])\*(?![\w*])"
+    r"|(?<![\w_])_(?![\s_])(?P<italic2>.+?)(?<![\s_])_(?![\w_])"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>https?://[^)\s]+)\)"
+)
+_TAG = re.compile(r"<[^>]+>")
+_ENTITY = re.compile(r"&(lt|gt|amp|quot|#x27);")
+
+
+def strip_tags(html_text: str) -> str:
+    return unescape(_TAG.sub("", html_text))
+
+
+def text_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def visible_length(html_text: str) -> int:
+    # Length Telegram counts after parsing: tags dropped, entities count as one character
+    return text_length(_ENTITY.sub("_", _TAG.sub("", html_text)))
+
+
+def render_inline(text: str) -> str:
+    # Markers without a closing pair are left as literal text
+    parts, position = [], 0
+    for match in _INLINE.finditer(text):
+        parts.append(escape(text[position:match.start()], quote=False))
+        kind = match.lastgroup
+        if kind == "code":
+            parts.append(f"<code>{escape(match['code'], quote=False)}</code>")
+        elif kind == "bold_italic":
+            parts.append(f"<b><i>{render_inline(match['bold_italic'])}</i></b>")
+        elif kind in ("bold", "bold2"):
+            parts.append(f"<b>{render_inline(match[kind])}</b>")
+        elif kind == "strike":
+            parts.append(f"<s>{render_inline(match['strike'])}</s>")
+        elif kind in ("italic", "italic2"):
+            parts.append(f"<i>{render_inline(match[kind])}</i>")
+        else:
+            parts.append(f"<a href=\"{escape(match['link_url'])}\">{escape(match['link_text'], quote=False)}</a>")
+        position = match.end()
+    parts.append(escape(text[position:], quote=False))
+    return "".join(parts)
+
+
+def render_line(line: str) -> str:
+    header = _HEADER.match(line)
+    if header:
+        return f"<b>{render_inline(header.group(1).strip())}</b>"
+    bullet = _BULLET.match(line)
+    if bullet:
+        return f"{bullet.group(1)}• {render_inline(bullet.group(2))}"
+    return render_inline(line)
+
+
+def split_blocks(text: str) -> List[Tuple[str, bool]]:
+    # Paragraphs and fenced code blocks as (raw text, is_code); an unclosed fence runs to the end
+    blocks, current, in_code = [], [], False
+    for line in text.replace("\r\n", "\n").split("\n"):
+        if _FENCE.match(line):
+            if current:
+                blocks.append(("\n".join(current), in_code))
+                current = []
+            in_code = not in_code
+        elif not in_code and not line.strip():
+            if current:
+                blocks.append(("\n".join(current), False))
+                current = []
+        else:
+            current.append(line)
+    if current:
+        blocks.append(("\n".join(current), in_code))
+    return blocks
+
+
+def render_block(raw: str, is_code: bool) -> str:
+    if is_code:
+        return f"<pre>{escape(raw, quote=False)}</pre>"
+    return "\n".join(render_line(line) for line in raw.split("\n"))
+
+
+def render_html(text: str) -> str:
+    # Model Markdown to Telegram HTML in one pass; the result always parses
+    return "\n\n".join(render_block(raw, is_code) for raw, is_code in split_blocks(text))
+
+
+def fitting_prefix(text: str, limit: int) -> int:
+    # Number of leading characters that fit in `limit` UTF-16 code units
+    units = 0
+    for index, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return index
+    return len(text)
+
+
+def _hard_split(raw: str, limit: int) -> List[str]:
+    # Last resort for a single huge line: cut on whitespace, or mid-word if there is none
+    pieces = []
+    while text_length(raw) > limit:
+        end = max(1, fitting_prefix(raw, limit))
+        cut = raw.rfind(" ", 0, end)
+        if cut <= 0:
+            cut = end
+        pieces.append(raw[:cut])
+        raw = raw[cut:].lstrip()
+    if raw:
+        pieces.append(raw)
+    return pieces
+
+
+def _fit_block(raw: str, is_code: bool, limit: int) -> List[str]:
+    # Rendered pieces of one block, each at most `limit` visible characters
+    rendered = render_block(raw, is_code)
+    if visible_length(rendered) <= limit:
+        return [rendered]
+    pieces, lines = [], []
+    for line in raw.split("\n"):
+        candidate = "\n".join(lines + [line])
+        if lines and visible_length(render_block(candidate, is_code)) > limit:
+            pieces.append(render_block("\n".join(lines), is_code))
+            lines = []
+        if visible_length(render_block(line, is_code)) > limit:
+            pieces.extend(render_block(piece, is_code) for piece in _hard_split(line, limit))
+            continue
+        lines.append(line)
+    if lines:
+        pieces.append(render_block("\n".join(lines), is_code))
+    return pieces
+
+
+def render_chunks(text: str, header: str = "", footer: str = "", limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    # Render and split on paragraph boundaries into messages of at most `limit` visible
+    # characters. `header` and `footer` are HTML placed on the first and last message.
+    header_length, footer_length = visible_length(header), visible_length(footer)
+    budget = limit - max(header_length, footer_length)
+    chunks, current, current_length = [], [], header_length
+    for raw, is_code in split_blocks(text):
+        for piece in _fit_block(raw, is_code, budget):
+            piece_length = visible_length(piece)
+            separator = 2 if current else 0
+            if current and current_length + separator + piece_length > budget:
+                chunks.append("\n\n".join(current))
+                current, current_length, separator = [], 0, 0
+            current.append(piece)
+            current_length += separator + piece_length
+    if current_length + footer_length > limit and current:
+        chunks.append("\n\n".join(current))
+        current = []
+    chunks.append("\n\n".join(current))
+    chunks[0] = header + chunks[0]
+    chunks[-1] = chunks[-1] + footer
+    return chunks
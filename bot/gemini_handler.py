@@ -1,33 +1,491 @@
+import time
 import asyncio
-import google.generativeai as genai
+import threading
+from contextlib import aclosing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from google.api_core import exceptions
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, Tuple, Union
 import logging
 
-from responses_templates import book_prompts, PROMPT
+from bot.cache import ResponseCache, normalize_question
+from bot.key_pool import KeyPool, ApiKey, NoKeyAvailable, RESPONSE, FIRST_CHUNK
+from bot.retrieval import Retriever
+from bot.conversation import Conversation, estimate_tokens
+from bot.routing import ModelRouter, FAST
+from bot.metrics import span, STAGE_SECONDS, GEMINI_KEY_SECONDS, GEMINI_MODEL_SECONDS, GEMINI_MODEL_TOKENS
+
+from responses_templates import SYSTEM_PROMPT, FOLLOW_UP_SYSTEM_PROMPT, TURN_PROMPT, ERROR_RESPONSE
+
+
+# Model used when no router is given
+MODEL_NAME = "gemini-2.0-flash-thinking-exp-01-21"
+
+QUOTA_ERRORS = (exceptions.ResourceExhausted, exceptions.TooManyRequests)
+
+# Errors after which the next API key is tried
+RETRYABLE_ERRORS = (exceptions.GoogleAPIError, asyncio.TimeoutError)
+
+# Ways a request ends without the key being at fault: the caller went away or the stream was dropped
+ABANDONED = (asyncio.CancelledError, GeneratorExit)
+
+# Hedges that can be saved up during quiet periods
+HEDGE_BURST = 3.0
+
+# A single prompt string, or chat turns when earlier turns of the conversation are sent along
+Contents = Union[str, List[Dict[str, Any]]]
+
+
+# The model answered but returned no text (blocked by safety filters or empty). The key worked,
+# and every other key would get the same answer, so the request is not retried.
+class BlockedAnswer(Exception):
+    pass
+
+
+def response_text(response, chunk: bool = False) -> str:
+    # The SDK raises ValueError from `.text` when there is no usable part. A stream chunk that only
+    # carries the final STOP reason is normal; anything else means there is no answer.
+    try:
+        return response.text
+    except ValueError as e:
+        candidates = getattr(response, "candidates", None)
+        if chunk and candidates and getattr(candidates[0].finish_reason, "name", None) == "STOP":
+            return ""
+        raise BlockedAnswer(str(e)) from e
 
 
 # Class to handle Gemini API requests
 class GeminiHandler:
-    def __init__(self, api_keys: List[str]):
+    def __init__(self, api_keys: List[str], cache: Optional[ResponseCache] = None, key_pool: Optional[KeyPool] = None,
+                 mode: str = "async", timeout: float = 120.0, executor_workers: int = 8,
+                 retriever: Optional[Retriever] = None, hedge: bool = False, hedge_ratio: float = 0.1,
+                 hedge_percentile: float = 95, timeout_factor: float = 3.0, min_timeout: float = 10.0,
+                 router: Optional[ModelRouter] = None):
         self.api_keys = api_keys
-        self.index = 0
-        self.configure_model()
+        # One key pool per model; a single pool means every question goes to the same model
+        self.router = router or ModelRouter({FAST: key_pool or KeyPool(api_keys, MODEL_NAME)})
+        self.cache = cache
+        self.retriever = retriever
+        self.mode = mode
+        self.timeout = timeout  # Upper bound; per key it adapts to observed latency
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.hedge = hedge
+        self.hedge_ratio = hedge_ratio
+        self.hedge_percentile = hedge_percentile
+        self.hedge_credit = 1.0
+        # Dedicated, sized executor for the blocking fallback mode
+        self.executor = ThreadPoolExecutor(executor_workers, thread_name_prefix="gemini") if mode == "thread" else None
+        self.waiters: Dict[Any, int] = {}
+        self.in_flight: Dict[Any, asyncio.Task] = {}
+        self.stats = {"issued": 0, "coalesced": 0, "hedged": 0, "hedge_wins": 0, "hedges_skipped": 0}
+
+    def _index_version(self, book: str) -> str:
+        return self.retriever.index_version(book) if self.retriever is not None else ""
+
+    async def _cached(self, book: str, question: str, history: Optional[Conversation]) -> Optional[str]:
+        # Answers to follow-ups depend on the conversation, so only standalone questions are cached
+        if self.cache is None or history:
+            return None
+        cached = await self.cache.get(book, question, self.router.preferred_model(book, question),
+                                      self._index_version(book))
+        if cached is not None:
+            logging.info(f"Cache hit for {book}: {question[:50]}")
+        return cached
+
+    async def generate_response(self, book: str, question: str, history: Optional[Conversation] = None):
+        cached = await self._cached(book, question, history)
+        if cached is not None:
+            return cached
+
+        # Identical concurrent questions share one upstream call
+        key = self._flight_key(book, question, history)
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["issued"] += 1
+            task = asyncio.ensure_future(self._generate(book, question, history))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish_flight(key, t))
+
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            with span("gemini"):
+                return await asyncio.shield(task)
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+                # Abort the upstream call once nobody is waiting for it
+                if not task.done():
+                    task.cancel()
+
+    async def stream_response(self, book: str, question: str,
+                              history: Optional[Conversation] = None) -> AsyncIterator[str]:
+        cached = await self._cached(book, question, history)
+        if cached is not None:
+            yield cached
+            return
+
+        key = self._flight_key(book, question, history)
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            try:
+                response = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+                # The stream we joined was cancelled by its owner; ask on our own
+                response = await self.generate_response(book, question, history)
+            yield response
+            return
+
+        # Register the stream so identical questions wait for its full text
+        self.stats["issued"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        future.add_done_callback(lambda f: self._finish_flight(key, f))
+        parts = []
+        try:
+            # Closed explicitly so a dropped stream stops the upstream call right away
+            async with aclosing(self._stream(book, question, history)) as chunks:
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            future.set_result("".join(parts))
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+
+    @staticmethod
+    def _flight_key(book: str, question: str, history: Optional[Conversation]) -> Tuple:
+        return book, normalize_question(question), history.fingerprint() if history else None
+
+    def _finish_flight(self, key, task: asyncio.Future):
+        self.in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Gemini request for {key[0]} failed: {task.exception()}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": len(self.in_flight), "models": self.router.report()}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _request(self, book: str, question: str, history: Optional[Conversation]) -> Tuple[str, Contents, int]:
+        # (system instruction, contents, estimated tokens). The system instruction goes out with
+        # every request; follow-ups send a short one, since earlier answers already show the format.
+        context = None
+        if self.retriever is not None:
+            with span("retrieval"):
+                context = self.retriever.context(book, question)
+        system = (FOLLOW_UP_SYSTEM_PROMPT if history else SYSTEM_PROMPT).format(book=book)
+        turn = TURN_PROMPT.format(question=question, context=context or "Find in web")
+        tokens = estimate_tokens(system) + estimate_tokens(turn)
+        if not history:
+            return system, turn, tokens
+        return system, history.contents() + [{"role": "user", "parts": [turn]}], tokens + history.tokens()
+
+    def _timeout_for(self, api_key: ApiKey, kind: str = RESPONSE) -> float:
+        # A multiple of the key's p99 for this kind of call, within [min_timeout, timeout]
+        p99 = api_key.latency_percentile(99, kind)
+        if p99 is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def _hedge_delay(self, pool: KeyPool, api_key: ApiKey, kind: str) -> Optional[float]:
+        if not self.hedge or len(pool) < 2:
+            return None
+        return api_key.latency_percentile(self.hedge_percentile, kind)
 
-    def configure_model(self):
-        genai.configure(api_key=self.api_keys[self.index])
-        self.model = genai.GenerativeModel("gemini-2.0-flash-thinking-exp-01-21")
+    def _take_hedge(self) -> bool:
+        # Each request earns `hedge_ratio` of a hedge, so hedges stay below that share of traffic
+        if self.hedge_credit >= 1:
+            self.hedge_credit -= 1
+            return True
+        self.stats["hedges_skipped"] += 1
+        return False
 
-    async def generate_response(self, book: str, question: str):
-        for _ in range(len(self.api_keys)):  # Iterate through API keys in case of failure
+    async def _call(self, model, contents: Contents, timeout: float) -> str:
+        if self.mode == "thread":
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(self.executor, lambda: model.generate_content(
+                contents, request_options={"timeout": timeout}))
+        else:
+            call = model.generate_content_async(contents, request_options={"timeout": timeout})
+        # Cancelling the awaiting task aborts the underlying grpc.aio call in async mode
+        response = await asyncio.wait_for(call, timeout)
+        return response_text(response)
+
+    def _iterate(self, model, contents: Contents) -> AsyncIterator[str]:
+        if self.mode == "thread":
+            return iterate_in_thread(model, contents, self.timeout, self.executor)
+        return iterate_async(model, contents, self.timeout)
+
+    async def _acquire(self, tier: str, tokens: int, tried: List[ApiKey], max_wait: Optional[float]) -> ApiKey:
+        # Questions waiting here are the model's queue, which the router checks for saturation
+        self.router.waiting[tier] += 1
+        try:
+            with span("key_wait"):
+                return await self.router.pools[tier].acquire(tokens, exclude=tried, max_wait=max_wait)
+        finally:
+            self.router.waiting[tier] -= 1
+
+    @staticmethod
+    def _observe(api_key: ApiKey, started: float, outcome: str):
+        elapsed = time.perf_counter() - started
+        GEMINI_KEY_SECONDS.observe(elapsed, key=api_key.name, outcome=outcome)
+        GEMINI_MODEL_SECONDS.observe(elapsed, model=api_key.model_name, outcome=outcome)
+
+    @staticmethod
+    def _count_tokens(model_name: str, tokens: int, text: str):
+        # Estimated, for comparing the cost of models rather than for billing
+        GEMINI_MODEL_TOKENS.inc(tokens, model=model_name, direction="input")
+        GEMINI_MODEL_TOKENS.inc(estimate_tokens(text), model=model_name, direction="output")
+
+    def _release_ok(self, pool: KeyPool, api_key: ApiKey, started: float):
+        self._observe(api_key, started, "ok")
+        pool.release(api_key, success=True)
+
+    def _release_on_error(self, pool: KeyPool, api_key: ApiKey, e: BaseException, started: float):
+        if isinstance(e, ABANDONED):
+            outcome = "cancelled"
+            pool.release(api_key, cancelled=True)
+        elif isinstance(e, BlockedAnswer):
+            outcome = "blocked"
+            logging.warning(f"{api_key.model_name} returned no answer text: {e}")
+            pool.release(api_key, success=True)
+        elif isinstance(e, QUOTA_ERRORS):
+            outcome = "quota"
+            logging.warning(f"API key {api_key.name} hit quota for {api_key.model_name}: {e}")
+            pool.release(api_key, success=False, rate_limited=True)
+        else:
+            outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            logging.warning(f"API key {api_key.name} failed on {api_key.model_name}: {e!r}")
+            pool.release(api_key, success=False)
+        self._observe(api_key, started, outcome)
+
+    async def _attempt(self, pool: KeyPool, api_key: ApiKey, system: str, contents: Contents) -> str:
+        # One complete request on one key; the key is released here whatever happens
+        started = time.perf_counter()
+        try:
+            text = await self._call(api_key.get_model(api_key.model_name, system), contents,
+                                    self._timeout_for(api_key, RESPONSE))
+        except BaseException as e:
+            self._release_on_error(pool, api_key, e, started)
+            raise
+        api_key.record_latency(time.perf_counter() - started, RESPONSE)
+        self._release_ok(pool, api_key, started)
+        return text
+
+    async def _open_stream(self, pool: KeyPool, api_key: ApiKey, system: str,
+                           contents: Contents) -> Tuple[AsyncIterator[str], Optional[str], float]:
+        # Start a stream and wait for its first chunk; failures up to that point release the key here
+        started = time.perf_counter()
+        iterator = self._iterate(api_key.get_model(api_key.model_name, system), contents)
+        try:
+            first = await asyncio.wait_for(iterator.__anext__(), self._timeout_for(api_key, FIRST_CHUNK))
+        except StopAsyncIteration:
+            first = None
+        except BaseException as e:
+            self._release_on_error(pool, api_key, e, started)
+            raise
+        latency = time.perf_counter() - started
+        api_key.record_latency(latency, FIRST_CHUNK)
+        STAGE_SECONDS.observe(latency, stage="gemini_first_chunk", outcome="ok")
+        return iterator, first, started
+
+    def _discard_stream(self, pool: KeyPool, api_key: ApiKey, opened: Tuple[AsyncIterator[str], Optional[str], float]):
+        iterator, _, started = opened
+        asyncio.ensure_future(iterator.aclose())
+        self._release_on_error(pool, api_key, asyncio.CancelledError(), started)
+
+    async def _hedged(self, pool: KeyPool, api_key: ApiKey, tokens: int, tried: List[ApiKey],
+                      start: Callable[[ApiKey], Awaitable[Any]], kind: str = RESPONSE,
+                      discard: Optional[Callable[[ApiKey, Any], None]] = None) -> Tuple[ApiKey, Any]:
+        # Run `start(api_key)`. If it is slower than the key's usual p95 for `kind`, run the same request on
+        # another idle key and keep whichever succeeds first; the loser is cancelled (or discarded
+        # if it finished too). Returns the winning key and its result.
+        self.hedge_credit = min(HEDGE_BURST, self.hedge_credit + self.hedge_ratio)
+        primary = asyncio.ensure_future(start(api_key))
+        attempts = {primary: api_key}
+        seen = set()
+        winner, error = None, None
+        try:
+            delay = self._hedge_delay(pool, api_key, kind)
+            if delay is not None:
+                done, _ = await asyncio.wait([primary], timeout=delay)
+                if not done and self._take_hedge():
+                    try:
+                        backup_key = await pool.acquire(tokens, exclude=tried, max_wait=0)
+                    except NoKeyAvailable:
+                        self.hedge_credit += 1  # Nothing was sent, refund the hedge
+                    else:
+                        tried.append(backup_key)
+                        self.stats["hedged"] += 1
+                        attempts[asyncio.ensure_future(start(backup_key))] = backup_key
+
+            pending = set(attempts)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    seen.add(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        discard(attempts[task], task.result())
+        finally:
+            for task, key in attempts.items():
+                if task is winner or task in seen:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and discard is not None:
+                    discard(key, task.result())
+
+        if winner is None:
+            raise error
+        if winner is not primary:
+            self.stats["hedge_wins"] += 1
+        return attempts[winner], winner.result()
+
+    async def _keys(self, book: str, question: str, history: Optional[Conversation],
+                    tokens: int) -> AsyncIterator[Tuple[KeyPool, ApiKey, List[ApiKey]]]:
+        # Acquired keys in routing order: every key of the chosen model at most once, then the fallback model
+        tiers = self.router.route(book, question, history, tokens)
+        for position, tier in enumerate(tiers):
+            pool = self.router.pools[tier]
+            # Don't queue long for the preferred model while the fallback could answer
+            max_wait = self.router.max_wait if position < len(tiers) - 1 else None
+            tried = []
+            for _ in range(len(pool)):
+                try:
+                    api_key = await self._acquire(tier, tokens, tried, max_wait)
+                except NoKeyAvailable as e:
+                    logging.warning(f"No {pool.model_name} API key available: {e}")
+                    break
+                tried.append(api_key)
+                yield pool, api_key, tried
+
+    async def _generate(self, book: str, question: str, history: Optional[Conversation] = None):
+        index_version = self._index_version(book)
+        system, contents, tokens = self._request(book, question, history)
+        async for pool, api_key, tried in self._keys(book, question, history, tokens):
             try:
-                response = await asyncio.to_thread(
-                    self.model.generate_content, PROMPT.format(book=book, question=question, context="Find in web")
-                )
-                return response.text
-            except exceptions.GoogleAPIError as e:
-                logging.warning(f"API key {self.api_keys[self.index]} failed: {e}")
-                self.index = (self.index + 1) % len(self.api_keys)
-                self.configure_model()
-
-        return "Ошибка при получении ответа. Попробуйте позже."
+                api_key, text = await self._hedged(
+                    pool, api_key, tokens, tried, lambda key: self._attempt(pool, key, system, contents))
+            except BlockedAnswer:
+                return ERROR_RESPONSE
+            except RETRYABLE_ERRORS:
+                continue  # Already released and logged by _attempt
+
+            self._count_tokens(api_key.model_name, tokens, text)
+            if self.cache is not None and text and not history:
+                self.cache.set(book, question, api_key.model_name, text, index_version)
+            return text
+
+        return ERROR_RESPONSE
+
+    async def _stream(self, book: str, question: str, history: Optional[Conversation] = None) -> AsyncIterator[str]:
+        index_version = self._index_version(book)
+        system, contents, tokens = self._request(book, question, history)
+        async for pool, api_key, tried in self._keys(book, question, history, tokens):
+            try:
+                # Hedging covers the wait for the first chunk; after that the stream stays on its key
+                api_key, (iterator, first, started) = await self._hedged(
+                    pool, api_key, tokens, tried, lambda key: self._open_stream(pool, key, system, contents),
+                    kind=FIRST_CHUNK, discard=partial(self._discard_stream, pool))
+            except BlockedAnswer:
+                break
+            except RETRYABLE_ERRORS:
+                continue
+
+            # Stream timings also include the time the consumer spends between chunks
+            parts = [first] if first else []
+            try:
+                if first:
+                    yield first
+                async for chunk in iterator:
+                    parts.append(chunk)
+                    yield chunk
+            except BlockedAnswer as e:
+                self._release_on_error(pool, api_key, e, started)
+                if parts:
+                    return  # Keep the part the user has already seen
+                break
+            except RETRYABLE_ERRORS as e:
+                self._release_on_error(pool, api_key, e, started)
+                if parts:  # Can't retry on another key once text reached the user
+                    raise
+                continue
+            except BaseException as e:
+                self._release_on_error(pool, api_key, e, started)
+                raise
+            finally:
+                await iterator.aclose()
+
+            self._release_ok(pool, api_key, started)
+            self._count_tokens(api_key.model_name, tokens, "".join(parts))
+            if self.cache is not None and parts and not history:
+                self.cache.set(book, question, api_key.model_name, "".join(parts), index_version)
+            return
+
+        yield ERROR_RESPONSE
+
+
+async def iterate_async(model, contents: Contents, timeout: float) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    response = await asyncio.wait_for(
+        model.generate_content_async(contents, stream=True, request_options={"timeout": timeout}), timeout
+    )
+    chunks = response.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - loop.time()))
+        except StopAsyncIteration:
+            break
+        text = response_text(chunk, chunk=True)
+        if text:
+            yield text
+
+
+async def iterate_in_thread(model, contents: Contents, timeout: float,
+                            executor: Optional[ThreadPoolExecutor] = None) -> AsyncIterator[str]:
+    # Bridge the SDK's blocking stream iterator into the event loop
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for chunk in model.generate_content(contents, stream=True, request_options={"timeout": timeout}):
+                if stopped.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, ("chunk", response_text(chunk, chunk=True)))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            kind, value = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+            if kind == "error":
+                raise value
+            if kind == "done":
+                break
+            if value:
+                yield value
+    finally:
+        # The blocking call can't be aborted, but stop it at the next chunk
+        stopped.set()
@@ -1,28 +1,44 @@
-from aiogram import Router, types, F
+from typing import Optional
+
+from aiogram import Router, Dispatcher, types, F
 from aiogram.filters import Command
 from bot.states import QuestionState
 from bot.middlewares import RateLimiter
 
-from responses_templates import book_prompts, help_text, start_text
+from bot.catalog import get_catalog
+from bot.services import Services
+from responses_templates import help_text
 
 import logging
 
 basic_router = Router()
 
 # Command handlers
-@basic_router.message(Command("start"), RateLimiter(limit=3, period=60))
+@basic_router.message(Command("start"), RateLimiter(limit=3, period=60, name="start"))
 async def send_welcome(message: types.Message):
     try:
-        book_list_markdown = "\n".join(f"- {book}" for book in book_prompts.keys())
-        await message.answer(start_text+f"\n📚 Доступные книги:\n\n{book_list_markdown}", parse_mode="Markdown")
+        catalog = get_catalog()
+        await message.answer(catalog.page_text("start"), reply_markup=catalog.page_keyboard("start"), parse_mode="Markdown")
         logging.info("/start handled")
     except Exception as e:
         logging.exception(f"Error in /start: {e}")
 
-@basic_router.message(Command("help"), RateLimiter(limit=3, period=60))
+@basic_router.message(Command("help"), RateLimiter(limit=3, period=60, name="help"))
 async def send_help(message: types.Message):
     try:
         await message.answer(help_text)
         logging.info("/help handled")
     except Exception as e:
         logging.exception(f"Error in /help: {e}")
+
+@basic_router.message(Command("stop"), RateLimiter(limit=3, period=60, name="stop"))
+async def stop_bot(message: types.Message, services: Services, dispatcher: Optional[Dispatcher] = None):
+    try:
+        if services.args.mode != "polling" or dispatcher is None:
+            await message.answer("Остановка недоступна в режиме webhook.")
+            return
+        await message.answer("Бот завершает работу. До свидания!")
+        await dispatcher.stop_polling()
+        logging.info("Bot stopped")
+    except Exception as e:
+        logging.exception(f"Error in /stop: {e}")
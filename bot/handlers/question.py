@@ -1,34 +1,23 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from difflib import get_close_matches
 from bot.states import QuestionState
-from bot.gemini_handler import GeminiHandler
+from bot.scheduler import SchedulerBusy
+from bot.message_editor import ThrottledEditor
+from bot.formatting import render_chunks
+from bot.conversation import Conversation
+from bot.catalog import get_catalog, title_key
+from bot.services import Services
+from bot.metrics import span
 from aiogram.types import CallbackQuery
 from bot.middlewares import RateLimiter
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from responses_templates import ERROR_RESPONSE
 
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import asyncio
-
-from responses_templates import book_prompts, PROMPT
-
-from bot.config import parse_args
-args = parse_args()
-api_keys = args.gemini_api_keys
-gemini_handler = GeminiHandler(api_keys)
-
-app_password = args.gmail_app_password
-
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SENDER_EMAIL = args.gmail_login  # Gmail login
-SENDER_PASSWORD = app_password  # Gmail App Password
-RECEIVER_EMAIL = args.receivers_email
-
 import logging
+from contextlib import aclosing
+from html import escape
 
 question_router = Router()
 
@@ -38,6 +27,18 @@ def create_navigation_keyboard():
          InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
     ])
 
+def create_book_list_keyboard(kind: str, page: int = 0):
+    buttons = get_catalog().page_buttons(kind, page)
+    if kind == "question":
+        buttons += create_navigation_keyboard().inline_keyboard
+    return InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+def create_suggestions_keyboard(books):
+    # Callback data carries a title hash, which stays valid across catalog reloads
+    buttons = [[InlineKeyboardButton(text=book, callback_data=f"pick_book_{title_key(book)}")] for book in books]
+    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 def create_rating_keyboard():
     buttons = [
         [InlineKeyboardButton(text="📖 Продолжить по книге", callback_data="continue_book")],
@@ -52,36 +53,59 @@ def create_rating_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-@question_router.message(Command("question"), RateLimiter(limit=5, period=60))
+@question_router.message(Command("question"), RateLimiter(limit=5, period=60, name="question"))
 async def ask_book(message: types.Message, state: FSMContext):
     try:
-        book_list_markdown = "\n".join(f"- {book}" for book in book_prompts.keys())
-        await message.answer(f"Введите название книги:\n\nНапример:\n{book_list_markdown}", reply_markup=create_navigation_keyboard(), parse_mode="Markdown")
+        await message.answer(get_catalog().page_text("question"), reply_markup=create_book_list_keyboard("question"), parse_mode="Markdown")
         await state.set_state(QuestionState.waiting_for_book)
         logging.info("/question handled")
     except Exception as e:
         logging.exception(f"Error in /question: {e}")
 
-@question_router.message(QuestionState.waiting_for_book, RateLimiter(limit=5, period=60))
+@question_router.callback_query(F.data.startswith("books_"))
+async def handle_books_page(callback: CallbackQuery):
+    _, kind, page = callback.data.split("_")
+    page = min(int(page), get_catalog().current.page_count - 1)
+    await callback.message.edit_text(get_catalog().page_text(kind, page), reply_markup=create_book_list_keyboard(kind, page), parse_mode="Markdown")
+    await callback.answer()
+
+@question_router.message(QuestionState.waiting_for_book, RateLimiter(limit=5, period=60, name="book"))
 async def save_book(message: types.Message, state: FSMContext):
     try:
         book_input = message.text.strip()
-        closest_match = get_close_matches(book_input, book_prompts.keys(), n=1, cutoff=0.7)
-        if not closest_match:
-            await message.answer("Книга отсутствует в списке доступных.")
-            await state.clear()
+        book_key, suggestions = await get_catalog().resolve(book_input)
+        if book_key:
+            await select_book(message, state, book_key)
+            return
+
+        if suggestions:
+            await message.answer("Уточните, какую книгу вы имели в виду:", reply_markup=create_suggestions_keyboard(suggestions))
             return
 
-        book_key = closest_match[0]
-        await state.update_data(book=book_key)
-        await message.answer(f"Теперь введите ваш вопрос:\n{book_prompts[book_key]}", reply_markup=create_navigation_keyboard())
-        await state.set_state(QuestionState.waiting_for_question)
-        logging.info(f"Book selected: {book_key}")
+        await message.answer("Книга отсутствует в списке доступных.")
+        await state.clear()
     except Exception as e:
         logging.exception(f"Error in save_book: {e}")
 
-@question_router.message(QuestionState.waiting_for_question, RateLimiter(limit=5, period=60))
-async def save_question(message: types.Message, state: FSMContext):
+@question_router.callback_query(QuestionState.waiting_for_book, F.data.startswith("pick_book_"))
+async def handle_pick_book(callback: CallbackQuery, state: FSMContext):
+    book_key = get_catalog().title_by_key(callback.data.split("_")[2])
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if book_key:
+        await select_book(callback.message, state, book_key)
+    else:
+        await callback.message.answer("Книга отсутствует в списке доступных.")
+    await callback.answer()
+
+async def select_book(message: types.Message, state: FSMContext, book_key: str):
+    # Picking a book starts a new conversation; "continue" keeps building on it
+    await state.update_data(book=book_key, history=None)
+    await message.answer(f"Теперь введите ваш вопрос:\n{get_catalog().hint(book_key)}", reply_markup=create_navigation_keyboard())
+    await state.set_state(QuestionState.waiting_for_question)
+    logging.info(f"Book selected: {book_key}")
+
+@question_router.message(QuestionState.waiting_for_question, RateLimiter(limit=5, period=60, name="ask"))
+async def save_question(message: types.Message, state: FSMContext, services: Services):
     try:
         user_data = await state.get_data()
         book = user_data.get("book")
@@ -97,28 +121,58 @@ async def save_question(message: types.Message, state: FSMContext):
             return
 
         logging.info(f"User {message.from_user.id} asked: {question[:100]}... about {book}")
+        history = Conversation.from_data(user_data.get("history"), max_tokens=services.args.history_tokens)
+
+        cancel_keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]])
+        placeholder = await message.answer(f"⏳ Ваш вопрос обрабатывается...", reply_markup=cancel_keyboard)
+        editor = ThrottledEditor(placeholder, interval=services.args.stream_edit_interval, reply_markup=cancel_keyboard)
+        header = f"📚 Ответ по книге {book}:\n\n"
+
+        async def notify_position(position: int):
+            await placeholder.edit_text(f"⏳ Вы {position}-й в очереди. Ответ придет автоматически.", reply_markup=cancel_keyboard)
+
+        async def stream_answer() -> str:
+            text = ""
+            # Closed right away on cancel, so the upstream call and its key are released at once
+            async with aclosing(services.gemini_handler.stream_response(book, question, history=history or None)) as stream:
+                async for chunk in stream:
+                    text += chunk
+                    await editor.update(header + text)
+            return text
+
+        user_id = message.from_user.id
+        active_generations = services.active_generations
+        generation = asyncio.ensure_future(services.scheduler.run(user_id, stream_answer, on_queued=notify_position))
+        active_generations[user_id] = generation
+        try:
+            await asyncio.wait([generation])
+        finally:
+            if active_generations.get(user_id) is generation:
+                del active_generations[user_id]
+            if not generation.done():
+                generation.cancel()
+
+        if generation.cancelled():
+            logging.info(f"Generation cancelled by user {user_id}")
+            return
+        try:
+            response = generation.result()
+        except SchedulerBusy:
+            await placeholder.edit_text("⚠️ Сейчас слишком много вопросов. Попробуйте через пару минут.")
+            return
+        if response and response != ERROR_RESPONSE:
+            history.add(question, response)
+        await state.update_data(question=question, response=response, history=history.to_data())
 
-        await message.answer(f"⏳ Ваш вопрос обрабатывается...")
-
-        response = await gemini_handler.generate_response(book, question)
-        await state.update_data(question=question, response=response)
-
-        if not response or len(response) > 4000:
+        if not response:
             response = "⚠️ Не удалось получить корректный ответ. Попробуйте переформулировать вопрос."
 
-        try:
-            await message.answer(
-                f"📚 Ответ по книге *{book}*:\n\n{response}\n\nПоставить оценку ответу:",
-                parse_mode="Markdown",
-                reply_markup=create_rating_keyboard()
-            )
-        except Exception as e:
-            logging.error(f"Error for user {message.from_user.id}: {str(e)}\nParse mode set 'HTML'")
-            await message.answer(
-                f"📚 Ответ по книге <b>{book}</b>:\n\n{response}\n\nПоставить оценку ответу:",
-                parse_mode="HTML",
-                reply_markup=create_rating_keyboard()
-            )
+        # Long answers are split on paragraphs; the rating keyboard goes on the last message
+        chunks = render_chunks(response, header=f"📚 Ответ по книге <b>{escape(book)}</b>:\n\n",
+                               footer="\n\nПоставить оценку ответу:")
+        with span("answer_delivery"):
+            await editor.deliver(chunks, reply_markup=create_rating_keyboard())
+        logging.info(f"Answer for user {message.from_user.id} delivered in {len(chunks)} message(s) after {editor.edits} edits")
 
     except Exception as e:
         logging.error(f"Error for user {message.from_user.id}: {str(e)}")
@@ -175,53 +229,53 @@ async def handle_add_comment(callback: CallbackQuery, state: FSMContext):
 
 
 @question_router.callback_query(F.data == "cancel_comment")
-async def handle_cancel_comment(callback: CallbackQuery, state: FSMContext):
+async def handle_cancel_comment(callback: CallbackQuery, state: FSMContext, services: Services):
     await state.set_state(None)
     await callback.message.edit_text("❌ Комментарий не был сохранен")
     await callback.answer()
-    await handle_finish_rating(callback, state)
+    await handle_finish_rating(callback, state, services)
 
 
 @question_router.callback_query(F.data == "finish_rating")
-async def handle_finish_rating(callback: CallbackQuery, state: FSMContext):
+async def handle_finish_rating(callback: CallbackQuery, state: FSMContext, services: Services):
     user_data = await state.get_data()
-    await save_feedback_to_file(user_data)
+    await save_feedback(services, callback.from_user.id, user_data)
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.answer("✅ Спасибо за ваш отзыв!")
     await state.clear()
 
 
 @question_router.message(QuestionState.waiting_for_comment)
-async def save_comment(message: types.Message, state: FSMContext):
+async def save_comment(message: types.Message, state: FSMContext, services: Services):
     await state.update_data(comment=message.text)
     user_data = await state.get_data()
-    await save_feedback_to_file(user_data)
+    await save_feedback(services, message.from_user.id, user_data)
     await message.answer("✅ Комментарий сохранен! Спасибо за ваш отзыв!")
     await state.clear()
 
 
-async def save_feedback_to_file(user_data: dict):
-    rating = user_data.get("rating", "Без оценки")
+async def save_feedback(services: Services, user_id: int, user_data: dict):
+    rating = user_data.get("rating")
     book = user_data.get("book")
     question = user_data.get("question")
     response = user_data.get("response")
-    comment = user_data.get("comment", "Без комментария")
-
-    with open("ratings.txt", "a", encoding="utf-8") as file:
-        file.write(
-            f"Книга: {book}\n"
-            f"Вопрос: {question}\n"
-            f"Ответ: {response}\n"
-            f"Оценка: {rating}\n"
-            f"Комментарий: {comment}\n"
-            f"-----------------------------\n"
-        )
+    comment = user_data.get("comment")
 
-    if comment != "Без комментария":
-        await send_email(book, question, response, rating, comment)
+    # Queued for the background writer; never blocks the event loop
+    services.feedback_store.submit({
+        "user_id": user_id,
+        "book": book,
+        "question": question,
+        "response": response,
+        "rating": rating,
+        "comment": comment,
+    })
 
+    if comment:
+        await send_email(services, book, question, response, rating or "Без оценки", comment)
 
-async def send_email(book, question, response, rating, comment):
+
+async def send_email(services: Services, book, question, response, rating, comment):
     subject = f"Новый отзыв на книгу: {book}"
     body = (
         f"Книга: {book}\n"
@@ -231,24 +285,12 @@ async def send_email(book, question, response, rating, comment):
         f"Комментарий: {comment}\n"
     )
 
-    msg = MIMEMultipart()
-    msg["From"] = SENDER_EMAIL
-    msg["To"] = RECEIVER_EMAIL
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain"))
-
-    try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, send_smtp_email, msg)
-        logging.info("Email send succefully")
-    except Exception as e:
-        logging.error(f"Error occured while sending email: {e}")
-
-def send_smtp_email(msg):
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, msg.as_string())
+    email_outbox = services.email_outbox
+    if email_outbox is None:
+        logging.warning("Email is not configured, feedback comment not sent")
+        return
+    # Persisted and delivered by the outbox worker
+    await email_outbox.enqueue(subject, body)
 
 
 @question_router.callback_query(lambda c: c.data == "go_back")
@@ -263,6 +305,9 @@ async def callback_go_back(callback: types.CallbackQuery, state: FSMContext):
 
 
 @question_router.callback_query(lambda c: c.data == "cancel")
-async def callback_cancel(callback: types.CallbackQuery, state: FSMContext):
+async def callback_cancel(callback: types.CallbackQuery, state: FSMContext, services: Services):
+    generation = services.active_generations.pop(callback.from_user.id, None)
+    if generation is not None:
+        generation.cancel()  # Aborts the upstream Gemini request too
     await state.clear()
     await callback.message.edit_text("❌ Действие отменено. Можете начать заново с /question")
@@ -0,0 +1,207 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+# Model objects kept per key, one per (model, system instruction); least recently used go first
+MODEL_CACHE_SIZE = 32
+
+# Successful requests remembered per key for latency percentiles
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+# google-generativeai release the client binding in ApiKey.get_model was checked against; the SDK is
+# no longer developed, and tests/test_key_pool.py fails if another version gets installed
+GENAI_SDK_VERSION = "0.8.6"
+
+# Latencies are kept apart per call type: a full answer takes much longer than a stream's first chunk
+RESPONSE = "response"
+FIRST_CHUNK = "first_chunk"
+
+
+# Token bucket refilled continuously at `per_minute` units per minute
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Requests larger than the whole bucket are allowed once it is full
+        amount = min(amount, self.capacity)
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill(time.monotonic())
+        self.tokens -= min(amount, self.capacity)
+
+    def utilization(self) -> float:
+        self._refill(time.monotonic())
+        return 1.0 - self.tokens / self.capacity
+
+
+# GenerativeModel has no public way to take a client: it falls back to the global genai.configure() one
+# unless its private attributes are set. Fail loudly if an SDK upgrade renamed them.
+def bind_clients(model: "genai.GenerativeModel", client, async_client):
+    for attribute in ("_client", "_async_client"):
+        if not hasattr(model, attribute):
+            raise RuntimeError(f"google-generativeai {GENAI_SDK_VERSION} is required: "
+                               f"GenerativeModel.{attribute} is missing")
+    model._client = client
+    model._async_client = async_client
+
+
+# Single API key with its own client, quotas and health state
+class ApiKey:
+    def __init__(self, key: str, model_name: str, rpm: int, tpm: int):
+        self.key = key
+        self.name = f"...{key[-4:]}"
+        self.model_name = model_name
+        self.client = None
+        self.async_client = None
+        self.models: "OrderedDict[Tuple[str, Optional[str]], genai.GenerativeModel]" = OrderedDict()
+        # Seconds to the complete answer, and to the first chunk of a stream
+        self.latencies = {RESPONSE: deque(maxlen=LATENCY_WINDOW), FIRST_CHUNK: deque(maxlen=LATENCY_WINDOW)}
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.stats = {"success": 0, "failure": 0, "rate_limited": 0}
+
+    @property
+    def model(self) -> "genai.GenerativeModel":
+        return self.get_model(self.model_name)
+
+    def get_model(self, model_name: str, system_instruction: Optional[str] = None) -> "genai.GenerativeModel":
+        # Bind the model to this key's client instead of the global genai.configure() one.
+        # Reusing the object only saves rebuilding it: the instruction is still sent with every request.
+        key = (model_name, system_instruction)
+        if key in self.models:
+            self.models.move_to_end(key)
+        else:
+            import google.generativeai as genai
+            from google.ai import generativelanguage as glm
+            if self.client is None:
+                self.client = glm.GenerativeServiceClient(client_options={"api_key": self.key})
+            if self.async_client is None:
+                # grpc.aio channels bind to the running loop, so create this one lazily
+                self.async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": self.key})
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            bind_clients(model, self.client, self.async_client)
+            self.models[key] = model
+            if len(self.models) > MODEL_CACHE_SIZE:
+                self.models.popitem(last=False)
+        return self.models[key]
+
+    def record_latency(self, seconds: float, kind: str = RESPONSE):
+        self.latencies[kind].append(seconds)
+
+    def latency_percentile(self, q: float, kind: str = RESPONSE) -> Optional[float]:
+        # None until enough requests of this kind succeeded to trust the estimate
+        latencies = self.latencies[kind]
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def wait_time(self, tokens: int) -> float:
+        cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        return max(cooldown, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "rpm_utilization": round(self.requests.utilization(), 3),
+            "tpm_utilization": round(self.tokens.utilization(), 3),
+            "cooldown": round(max(0.0, self.cooldown_until - time.monotonic()), 1),
+            "latency_p50": self.latency_percentile(50),
+            "latency_p95": self.latency_percentile(95),
+            "first_chunk_p50": self.latency_percentile(50, FIRST_CHUNK),
+            "first_chunk_p95": self.latency_percentile(95, FIRST_CHUNK),
+        }
+
+
+class NoKeyAvailable(Exception):
+    pass
+
+
+# Pool handing out API keys round-robin or least-loaded, with per-key quotas and cooldowns
+class KeyPool:
+    def __init__(self, api_keys: List[str], model_name: str, rpm: int = 10, tpm: int = 1_000_000,
+                 strategy: str = "least-loaded", base_cooldown: float = 5.0, max_cooldown: float = 300.0,
+                 max_wait: float = 30.0):
+        self.model_name = model_name
+        self.keys = [ApiKey(key, model_name, rpm, tpm) for key in api_keys]
+        self.strategy = strategy
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.max_wait = max_wait
+        self.next_index = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self) -> List[ApiKey]:
+        if self.strategy == "round-robin":
+            start = self.next_index
+            self.next_index = (self.next_index + 1) % len(self.keys)
+            return self.keys[start:] + self.keys[:start]
+        return sorted(self.keys, key=lambda k: (k.in_flight, k.requests.utilization()))
+
+    async def acquire(self, tokens: int = 0, exclude: Optional[List[ApiKey]] = None,
+                      max_wait: Optional[float] = None) -> ApiKey:
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        while True:
+            waits = []
+            for api_key in self._candidates():
+                if exclude and api_key in exclude:
+                    continue
+                wait = api_key.wait_time(tokens)
+                if wait == 0:
+                    api_key.requests.consume(1)
+                    api_key.tokens.consume(tokens)
+                    api_key.in_flight += 1
+                    return api_key
+                waits.append(wait)
+
+            if not waits:
+                raise NoKeyAvailable("All API keys are excluded")
+            sleep_for = min(waits)
+            if time.monotonic() + sleep_for > deadline:
+                raise NoKeyAvailable(f"No API key available within {max_wait}s")
+            await asyncio.sleep(sleep_for)
+
+    def release(self, api_key: ApiKey, success: bool = True, rate_limited: bool = False, cancelled: bool = False):
+        api_key.in_flight -= 1
+        if cancelled:
+            return
+        if success:
+            api_key.failures = 0
+            api_key.stats["success"] += 1
+            return
+
+        api_key.failures += 1
+        api_key.stats["rate_limited" if rate_limited else "failure"] += 1
+        # Quota errors always back off; other errors open the circuit after repeated failures
+        if rate_limited or api_key.failures >= 3:
+            cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (api_key.failures - 1))
+            api_key.cooldown_until = time.monotonic() + cooldown
+            logging.warning(f"API key {api_key.name} cooling down for {cooldown:.0f}s")
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {api_key.name: api_key.report() for api_key in self.keys}
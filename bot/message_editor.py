@@ -0,0 +1,76 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message, InlineKeyboardMarkup
+
+from bot.formatting import strip_tags, text_length, fitting_prefix
+
+MAX_PREVIEW_LENGTH = 4000
+
+
+async def with_flood_control(call: Callable[[], Awaitable[Any]], retries: int = 3) -> Any:
+    # Telegram's flood control tells how long to wait; honour it instead of failing the delivery
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Flood control, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+
+
+# Progressively edits one message, coalescing updates to respect Telegram's edit limits
+class ThrottledEditor:
+    def __init__(self, message: Message, interval: float = 1.5, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        self.message = message
+        self.interval = interval
+        self.reply_markup = reply_markup  # Kept on intermediate edits, e.g. a cancel button
+        self.last_edit = 0.0
+        self.last_text = message.text or ""
+        self.edits = 0
+
+    async def update(self, text: str):
+        # Intermediate text is shown as-is: partial Markdown is rarely valid
+        if time.monotonic() - self.last_edit < self.interval:
+            return
+        if text_length(text) > MAX_PREVIEW_LENGTH:
+            text = text[:fitting_prefix(text, MAX_PREVIEW_LENGTH)] + "…"
+        await self._edit(text, reply_markup=self.reply_markup)
+
+    async def finish(self, text: str, parse_mode: Optional[str] = None,
+                     reply_markup: Optional[InlineKeyboardMarkup] = None):
+        await self._edit(text, parse_mode=parse_mode, reply_markup=reply_markup, force=True)
+
+    async def deliver(self, chunks: List[str], reply_markup: Optional[InlineKeyboardMarkup] = None):
+        # HTML chunks in order: the first replaces the progressive message, the rest follow as
+        # new messages, and only the last one carries `reply_markup`
+        for index, chunk in enumerate(chunks):
+            markup = reply_markup if index == len(chunks) - 1 else None
+            if index == 0:
+                send = lambda text, mode: self.finish(text, parse_mode=mode, reply_markup=markup)
+            else:
+                send = lambda text, mode: self.message.answer(text, parse_mode=mode, reply_markup=markup)
+            try:
+                await with_flood_control(lambda: send(chunk, "HTML"))
+            except TelegramBadRequest as e:
+                # The formatter escapes everything, so this should not happen; never lose the answer
+                logging.error(f"HTML chunk rejected, sending as plain text: {e}")
+                await with_flood_control(lambda: send(strip_tags(chunk), None))
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None, force: bool = False):
+        if text == self.last_text and not force:
+            return
+        self.last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+            self.last_text = text
+            self.edits += 1
+        except Exception as e:
+            if force:
+                raise
+            logging.warning(f"Progressive edit skipped: {e}")
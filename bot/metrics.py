@@ -0,0 +1,228 @@
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds; covers Telegram round trips through long thinking-model generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        # Updates may come from executor threads (feedback writer, SMTP, FSM flush)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    # `collect` returns a number, or a {label values tuple: number} dict for labelled gauges
+    def __init__(self, name: str, help_text: str, collect: Callable[[], Any], labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logging.warning(f"Gauge {self.name} failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last one is +Inf), sum, count]
+        self.series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th percentile; None without data
+        with self.lock:
+            series = self.series.get(self._key(labels))
+            if series is None or not series[2]:
+                return None
+            counts, total = list(series[0]), series[2]
+        rank, seen = q / 100 * total, 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+# Context manager observing the elapsed time; sets the `outcome` label when the histogram has one
+class Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if "outcome" in self.histogram.labelnames and "outcome" not in self.labels:
+            if exc_type is None:
+                outcome = "ok"
+            elif issubclass(exc_type, asyncio.CancelledError):
+                outcome = "cancelled"
+            else:
+                outcome = "error"
+            self.labels = {**self.labels, "outcome": outcome}
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Re-registering a name replaces it, so gauges can be rebound to new service instances
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, collect, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Time spent in update handlers", ("handler", "outcome"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "bot_stage_seconds", "Time spent in internal stages of request handling", ("stage", "outcome"))
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "bot_telegram_request_seconds", "Telegram Bot API request latency", ("method", "outcome"))
+GEMINI_KEY_SECONDS = REGISTRY.histogram(
+    "bot_gemini_key_seconds", "Gemini request latency per API key", ("key", "outcome"))
+GEMINI_MODEL_SECONDS = REGISTRY.histogram(
+    "bot_gemini_model_seconds", "Gemini request latency per model", ("model", "outcome"))
+GEMINI_MODEL_TOKENS = REGISTRY.counter(
+    "bot_gemini_model_tokens_total", "Estimated tokens sent to and received from each model", ("model", "direction"))
+MODEL_ROUTES = REGISTRY.counter(
+    "bot_model_routes_total", "Questions routed to each model and why", ("model", "reason"))
+
+
+def span(stage: str) -> Timer:
+    return STAGE_SECONDS.time(stage=stage)
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = REGISTRY):
+    # Plain aiohttp endpoint for local Prometheus scraping; returns the runner to clean up
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
@@ -1,34 +1,30 @@
-import time
+import math
+import asyncio
 import logging
-from typing import Dict, Any, Callable, Awaitable
+from typing import Dict, Any, Callable, Awaitable, Optional, Set
 from aiogram.filters import BaseFilter
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import Message, TelegramObject
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from bot.rate_limit import get_store
+from bot.metrics import HANDLER_SECONDS, TELEGRAM_SECONDS
 
 import logging
 
 # Define RateLimiter filter
 class RateLimiter(BaseFilter):
-    def __init__(self, limit: int = 1, period: int = 5):
+    def __init__(self, limit: int = 1, period: int = 5, name: Optional[str] = None):
         self.limit = limit
         self.period = period
-        self.users = {}
+        # Limiters with the same name share one budget in the shared store
+        self.name = name or f"{limit}/{period}:{id(self)}"
 
     async def __call__(self, message: Message) -> bool:
-        user_id = message.from_user.id
-        now = time.time()
-
-        if user_id not in self.users:
-            self.users[user_id] = [now]
-            return True
-
-        timestamps = [t for t in self.users[user_id] if now - t < self.period]
-        if len(timestamps) < self.limit:
-            timestamps.append(now)
-            self.users[user_id] = timestamps
+        allowed, retry_after = await get_store().hit(f"{self.name}:{message.from_user.id}", self.limit, self.period)
+        if allowed:
             return True
 
-        await message.answer(f"⚠️ Слишком много запросов. Подождите {self.period} секунд.")
+        await message.answer(f"⚠️ Слишком много запросов. Подождите {math.ceil(retry_after)} секунд.")
         return False
 
 # Define Error handler
@@ -45,3 +41,40 @@ class ErrorHandlerMiddleware(BaseMiddleware):
             logging.exception(f"Unhandled exception: {e}")
             await event.answer("⚠️ Произошла непредвиденная ошибка. Попробуйте позже.")
             return None
+
+# Keeps the set of tasks handling updates right now, so shutdown can wait for them
+class HandlerTasksMiddleware(BaseMiddleware):
+    def __init__(self, tasks: Set[asyncio.Task]):
+        self.tasks = tasks
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.tasks.discard(task)
+
+# Times every handler call; registered after ErrorHandlerMiddleware so failures are labelled
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with HANDLER_SECONDS.time(handler=name):
+            return await handler(event, data)
+
+# Times every Bot API request made through the session
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        with TELEGRAM_SECONDS.time(method=getattr(method, "__api_method__", type(method).__name__)):
+            return await make_request(bot, method)
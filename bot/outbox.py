@@ -0,0 +1,218 @@
+import time
+import asyncio
+import sqlite3
+import smtplib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from typing import List, Optional, Tuple
+
+from bot.metrics import span
+
+
+# Durable email queue delivered over one reused SMTP connection, optionally as digests
+class EmailOutbox:
+    def __init__(self, server: str, port: int, login: str, password: str, receiver: str,
+                 db_path: str = "outbox.sqlite", digest_size: int = 1, digest_interval: float = 0,
+                 max_attempts: int = 5, base_delay: float = 30.0, poll_interval: float = 5.0,
+                 idle_timeout: float = 120.0, failed_retention: float = 7 * 24 * 3600, starttls: bool = True,
+                 busy_timeout: float = 1.0, enqueue_attempts: int = 3):
+        self.server = server
+        self.port = port
+        self.login = login
+        self.password = password
+        self.receiver = receiver
+        self.digest_size = max(1, digest_size)
+        self.digest_interval = digest_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.failed_retention = failed_retention
+        self.starttls = starttls
+        self.enqueue_attempts = enqueue_attempts
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+        # smtplib is blocking; one dedicated thread owns the connection
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="smtp")
+        # The database is shared by the webhook workers; its queries wait on their locks off the event loop
+        self.db_executor = ThreadPoolExecutor(1, thread_name_prefix="outbox-db")
+        self.worker: Optional[asyncio.Task] = None
+        self.delivery_enabled = True  # Only one process delivers when several share the outbox
+        self.wakeup: Optional[asyncio.Event] = None
+        self.stats = {"queued": 0, "sent_emails": 0, "sent_messages": 0, "failures": 0, "connections": 0}
+        self.db = sqlite3.connect(db_path, timeout=busy_timeout, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY, subject TEXT NOT NULL, body TEXT NOT NULL, created REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, status TEXT NOT NULL DEFAULT 'pending')"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)")
+        # Sent messages are deleted; dropped ones are kept for `failed_retention` seconds
+        self.db.execute("DELETE FROM outbox WHERE status = 'sent' OR (status = 'failed' AND created < ?)",
+                        (time.time() - failed_retention,))
+        self.db.commit()
+        self.pending = self._count_pending()  # Last known queue depth, for the metrics gauge
+
+    def start(self):
+        if self.worker is None and self.delivery_enabled:
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+
+    async def enqueue(self, subject: str, body: str):
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.enqueue_attempts + 1):
+            try:
+                await loop.run_in_executor(self.db_executor, self._insert, subject, body)
+                break
+            except sqlite3.OperationalError as e:
+                # Another worker holds the write lock past the busy timeout
+                if attempt == self.enqueue_attempts:
+                    raise
+                logging.warning(f"Email outbox busy ({e}), retrying")
+                await asyncio.sleep(0.5 * attempt)
+        self.stats["queued"] += 1
+        self.start()
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def pending_count(self) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, self._count_pending)
+
+    def _insert(self, subject: str, body: str):
+        now = time.time()
+        self.db.execute("INSERT INTO outbox (subject, body, created, next_attempt) VALUES (?, ?, ?, ?)",
+                        (subject, body, now, now))
+        self.db.commit()
+        self.pending = self._count_pending()
+
+    def _count_pending(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    async def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._disconnect)
+        self.executor.shutdown(wait=True)
+        await loop.run_in_executor(self.db_executor, self.db.close)
+        self.db_executor.shutdown(wait=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+            try:
+                while True:
+                    batch = await loop.run_in_executor(self.db_executor, self._due_batch)
+                    if not batch:
+                        break
+                    ids = [row[0] for row in batch]
+                    try:
+                        await loop.run_in_executor(self.executor, self._send, *self._compose(batch))
+                    except Exception as e:
+                        await loop.run_in_executor(self.db_executor, self._retry_later, ids, e)
+                        break
+                    await loop.run_in_executor(self.db_executor, self._mark_sent, ids)
+                await loop.run_in_executor(self.executor, self._close_idle)
+            except Exception as e:
+                logging.exception(f"Email outbox failed: {e}")
+
+    def _due_batch(self) -> List[Tuple[int, str, str, int]]:
+        now = time.time()
+        self.pending = self._count_pending()
+        rows = self.db.execute(
+            "SELECT id, subject, body, attempts, created FROM outbox "
+            "WHERE status = 'pending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+            (now, self.digest_size),
+        ).fetchall()
+        if not rows:
+            return []
+        # In digest mode wait for a full batch, or, if an interval is set, for the oldest message to age out
+        if len(rows) < self.digest_size and (self.digest_interval <= 0 or now - rows[0][4] < self.digest_interval):
+            return []
+        return [row[:4] for row in rows]
+
+    def _compose(self, batch: List[Tuple[int, str, str, int]]) -> Tuple[str, str]:
+        if len(batch) == 1:
+            return batch[0][1], batch[0][2]
+        subject = f"Новые отзывы: {len(batch)}"
+        body = "\n-----------------------------\n".join(f"{row[1]}\n\n{row[2]}" for row in batch)
+        return subject, body
+
+    def _send(self, subject: str, body: str):
+        with span("smtp_send"):
+            self._deliver(subject, body)
+
+    def _deliver(self, subject: str, body: str):
+        msg = MIMEMultipart()
+        msg["From"] = self.login
+        msg["To"] = self.receiver
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "plain"))
+
+        try:
+            self._connection().sendmail(self.login, self.receiver, msg.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The reused connection may have gone stale; reconnect once. Other SMTP errors back off.
+            self._disconnect()
+            self._connection().sendmail(self.login, self.receiver, msg.as_string())
+        self.last_used = time.monotonic()
+
+    def _connection(self) -> smtplib.SMTP:
+        if self.smtp is None:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+            if self.starttls:
+                smtp.starttls()
+            smtp.login(self.login, self.password)
+            self.smtp = smtp
+            self.stats["connections"] += 1
+        return self.smtp
+
+    def _disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+    def _close_idle(self):
+        if self.smtp is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self._disconnect()
+
+    def _mark_sent(self, ids: List[int]):
+        self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self.db.commit()
+        self.pending = self._count_pending()
+        self.stats["sent_emails"] += 1
+        self.stats["sent_messages"] += len(ids)
+        logging.info(f"Email with {len(ids)} feedback message(s) sent")
+
+    def _retry_later(self, ids: List[int], error: Exception):
+        self.stats["failures"] += 1
+        now = time.time()
+        for (message_id, attempts) in self.db.execute(
+                f"SELECT id, attempts FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall():
+            attempts += 1
+            if attempts >= self.max_attempts:
+                self.db.execute("UPDATE outbox SET attempts = ?, status = 'failed' WHERE id = ?", (attempts, message_id))
+                logging.error(f"Email {message_id} dropped after {attempts} attempts: {error}")
+            else:
+                delay = self.base_delay * 2 ** (attempts - 1)
+                self.db.execute("UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                                (attempts, now + delay, message_id))
+                logging.warning(f"Email {message_id} failed ({error}), retrying in {delay:.0f}s")
+        self.db.commit()
+        self.pending = self._count_pending()
@@ -0,0 +1,139 @@
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+
+# Storage interface for GCRA state: one "theoretical arrival time" float per key
+class RateLimitStore(ABC):
+    # Register a request; return (allowed, seconds until the next request is allowed)
+    @abstractmethod
+    async def hit(self, key: str, limit: int, period: float) -> Tuple[bool, float]:
+        ...
+
+    # Drop keys whose state has fully decayed; return how many were dropped
+    @abstractmethod
+    def evict_idle(self) -> int:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+def gcra(tat: float, now: float, limit: int, period: float) -> Tuple[bool, float, float]:
+    # Generic cell rate algorithm: `limit` requests per `period`, bursts up to `limit`
+    interval = period / limit
+    new_tat = max(tat, now) + interval
+    allow_at = new_tat - period
+    if now < allow_at:
+        return False, allow_at - now, tat
+    return True, 0.0, new_tat
+
+
+class MemoryStore(RateLimitStore):
+    def __init__(self, evict_interval: float = 60.0):
+        # Ordered by last hit, so idle keys collect at the front
+        self.tats: "OrderedDict[str, float]" = OrderedDict()
+        self.evict_interval = evict_interval
+        self.next_eviction = time.time() + evict_interval
+        self.lock = threading.Lock()
+
+    async def hit(self, key: str, limit: int, period: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self.lock:
+            allowed, retry_after, tat = gcra(self.tats.get(key, 0.0), now, limit, period)
+            self.tats[key] = tat
+            self.tats.move_to_end(key)
+        if now >= self.next_eviction:
+            self.evict_idle()
+        return allowed, retry_after
+
+    def evict_idle(self) -> int:
+        # Walks from the least recently hit key and stops at the first one still active, so
+        # the cost is proportional to the evicted keys, not to all stored ones. A key with a
+        # longer period can hold back newer idle keys until it decays itself.
+        now = time.time()
+        evicted = 0
+        with self.lock:
+            self.next_eviction = now + self.evict_interval
+            while self.tats:
+                key, tat = next(iter(self.tats.items()))
+                if tat > now:
+                    break
+                del self.tats[key]
+                evicted += 1
+        if evicted:
+            logging.debug(f"Rate limiter evicted {evicted} idle keys")
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self.tats)
+
+
+# SQLite-backed store, so several bot processes can enforce one combined limit
+class SQLiteStore(RateLimitStore):
+    def __init__(self, path: str, evict_interval: float = 300.0, busy_timeout: float = 0.5):
+        self.db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self.evict_interval = evict_interval
+        self.next_eviction = time.time() + evict_interval
+        self.lock = threading.Lock()
+        # Transactions wait on other processes' locks and on disk; one thread runs them off the event loop
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="rate-limit")
+
+    async def hit(self, key: str, limit: int, period: float) -> Tuple[bool, float]:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._hit, key, limit, period)
+        except sqlite3.OperationalError as e:
+            # The database stayed locked past the busy timeout: let the request through rather than stall it
+            logging.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return True, 0.0
+
+    def _hit(self, key: str, limit: int, period: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                allowed, retry_after, tat = gcra(row[0] if row else 0.0, now, limit, period)
+                if allowed:
+                    self.db.execute("INSERT OR REPLACE INTO rate_limits VALUES (?, ?)", (key, tat))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        if now >= self.next_eviction:
+            try:
+                self.evict_idle()
+            except sqlite3.OperationalError as e:
+                logging.warning(f"Rate limit eviction skipped: {e}")
+        return allowed, retry_after
+
+    def evict_idle(self) -> int:
+        now = time.time()
+        with self.lock:
+            self.next_eviction = now + self.evict_interval
+            return self.db.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,)).rowcount
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+
+_store: RateLimitStore = MemoryStore()
+
+
+def get_store() -> RateLimitStore:
+    return _store
+
+
+def set_store(store: RateLimitStore):
+    global _store
+    _store = store
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import math
+import mmap
+import time
+import heapq
+import hashlib
+import logging
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+STEM_LENGTH = 6  # Crude stemming: Russian inflections mostly change word endings
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+# Bumped whenever chunking changes, so indexes built the old way are rebuilt on start
+CHUNKER_VERSION = 2
+
+
+def tokenize(text: str) -> List[str]:
+    return [word[:STEM_LENGTH] for word in _WORD.findall(text.lower()) if len(word) > 2]
+
+
+def split_paragraph(text: str, max_chars: int) -> Iterator[str]:
+    # Pieces of up to `max_chars`, cut between sentences, or between words inside an overlong sentence
+    if len(text) <= max_chars:
+        yield text
+        return
+    piece = ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            if piece:
+                yield piece
+                piece = ""
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if piece and len(piece) + 1 + len(sentence) > max_chars:
+            yield piece
+            piece = ""
+        piece = f"{piece} {sentence}" if piece else sentence
+    if piece:
+        yield piece
+
+
+def iter_chunks(path: str, max_chars: int = 1200) -> Iterator[str]:
+    # Streams the book from disk and packs paragraphs into chunks of up to `max_chars`. Every
+    # line break ends a paragraph: most .txt books put each paragraph on one line.
+    parts, size = [], 0
+    with open(path, encoding="utf-8", errors="ignore") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            for text in split_paragraph(line, max_chars):
+                if parts and size + 1 + len(text) > max_chars:
+                    yield "\n".join(parts)
+                    parts, size = [], 0
+                size += len(text) + (1 if parts else 0)
+                parts.append(text)
+    if parts:
+        yield "\n".join(parts)
+
+
+def _mapped(path: str, typecode: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(array(typecode))
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(data).cast(typecode)
+
+
+# BM25 index of one book, kept in memory-mapped files
+class BookIndexFiles:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        with open(os.path.join(directory, "terms.json"), encoding="utf-8") as file:
+            self.terms: Dict[str, List[int]] = json.load(file)  # term -> [df, start, length]
+        self.postings = _mapped(os.path.join(directory, "postings.bin"), "I")  # (chunk id, tf) pairs
+        self.doc_lengths = _mapped(os.path.join(directory, "lengths.bin"), "I")
+        self.offsets = _mapped(os.path.join(directory, "offsets.bin"), "Q")
+        self.texts = open(os.path.join(directory, "chunks.bin"), "rb")
+
+    def chunk(self, chunk_id: int) -> str:
+        start, end = self.offsets[chunk_id], self.offsets[chunk_id + 1]
+        self.texts.seek(start)
+        return self.texts.read(end - start).decode("utf-8")
+
+    def search(self, query: str, k: int = 5, k1: float = 1.2, b: float = 0.75) -> List[Tuple[int, float]]:
+        count = self.meta["chunks"]
+        if not count:
+            return []
+        average = self.meta["average_length"]
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            df, start, length = entry
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for position in range(start, start + 2 * length, 2):
+                chunk_id, tf = self.postings[position], self.postings[position + 1]
+                norm = k1 * (1 - b + b * self.doc_lengths[chunk_id] / average)
+                scores[chunk_id] += idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def close(self):
+        self.texts.close()
+
+
+# Builds and queries per-book BM25 indexes from plain-text books in a data directory
+class Retriever:
+    def __init__(self, books_dir: str, index_dir: str = "index", passages: int = 5, max_tokens: int = 1500,
+                 chunk_chars: int = 1200):
+        self.books_dir = books_dir
+        self.index_dir = index_dir
+        self.passages = passages
+        self.max_tokens = max_tokens
+        self.chunk_chars = chunk_chars
+        self.indexes: Dict[str, BookIndexFiles] = {}
+        self.missing: Dict[str, float] = {}  # book -> when to look for its index again
+        self.versions: Dict[str, str] = {}  # book -> index_version() of its loaded index
+
+    def book_files(self) -> Dict[str, str]:
+        # <books_dir>/<book title>.txt
+        if not os.path.isdir(self.books_dir):
+            return {}
+        return {
+            os.path.splitext(name)[0]: os.path.join(self.books_dir, name)
+            for name in sorted(os.listdir(self.books_dir)) if name.endswith(".txt")
+        }
+
+    def index_path(self, book: str) -> str:
+        return os.path.join(self.index_dir, hashlib.sha1(book.encode("utf-8")).hexdigest()[:16])
+
+    def build_all(self):
+        for book, path in self.book_files().items():
+            try:
+                self.build(book, path)
+            except Exception as e:
+                logging.exception(f"Failed to index {path}: {e}")
+
+    def build(self, book: str, path: str, force: bool = False) -> bool:
+        # Incremental: a book is re-indexed only when its source file changed
+        stat = os.stat(path)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime}
+        directory = self.index_path(book)
+        meta_path = os.path.join(directory, "meta.json")
+        if not force and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+            if (meta.get("source") == source and meta.get("chunk_chars") == self.chunk_chars
+                    and meta.get("chunker") == CHUNKER_VERSION):
+                self._open(book, directory)
+                return False
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)  # Marks the book stale until the rebuild completes
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths, offsets = array("I"), array("Q", [0])
+        with open(os.path.join(directory, "chunks.bin.tmp"), "wb") as texts:
+            for chunk_id, chunk in enumerate(iter_chunks(path, self.chunk_chars)):
+                tokens = tokenize(chunk)
+                for term, tf in Counter(tokens).items():
+                    postings[term].append((chunk_id, tf))
+                lengths.append(len(tokens))
+                data = chunk.encode("utf-8")
+                texts.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+        terms, flat = {}, array("I")
+        for term, entries in postings.items():
+            terms[term] = [len(entries), len(flat), len(entries)]
+            for chunk_id, tf in entries:
+                flat.append(chunk_id)
+                flat.append(tf)
+
+        for name, values in (("postings.bin", flat), ("lengths.bin", lengths), ("offsets.bin", offsets)):
+            with open(os.path.join(directory, name + ".tmp"), "wb") as file:
+                values.tofile(file)
+        with open(os.path.join(directory, "terms.json.tmp"), "w", encoding="utf-8") as file:
+            json.dump(terms, file, ensure_ascii=False)
+        meta = {
+            "book": book, "source": source, "chunk_chars": self.chunk_chars, "chunker": CHUNKER_VERSION,
+            "chunks": len(lengths),
+            "average_length": (sum(lengths) / len(lengths)) if lengths else 0.0,
+        }
+        with open(os.path.join(directory, "meta.json.tmp"), "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False)
+        # meta.json goes last, so a crash mid-build is picked up on the next start
+        for name in ("chunks.bin", "postings.bin", "lengths.bin", "offsets.bin", "terms.json", "meta.json"):
+            os.replace(os.path.join(directory, name + ".tmp"), os.path.join(directory, name))
+
+        self._open(book, directory)
+        logging.info(f"Indexed {book}: {len(lengths)} chunks, {len(terms)} terms")
+        return True
+
+    def _open(self, book: str, directory: str):
+        previous = self.indexes.pop(book, None)
+        if previous is not None:
+            previous.close()
+        index = self.indexes[book] = BookIndexFiles(directory)
+        source = json.dumps([index.meta, self.passages, self.max_tokens], sort_keys=True)
+        self.versions[book] = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+    def _open_built(self, book: str) -> Optional[BookIndexFiles]:
+        # Picks up indexes built by another process (e.g. webhook worker 0)
+        if time.monotonic() < self.missing.get(book, 0.0):
+            return None
+        directory = self.index_path(book)
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            self.missing[book] = time.monotonic() + 60
+            return None
+        self._open(book, directory)
+        return self.indexes[book]
+
+    def index_version(self, book: str) -> str:
+        # Identifies the passages context() can return for a book; empty while it has no index.
+        # Computed once per loaded index, since it is asked for on every cache lookup.
+        if book not in self.indexes and self._open_built(book) is None:
+            return ""
+        return self.versions[book]
+
+    def context(self, book: str, question: str) -> Optional[str]:
+        # Top passages for the question, in book order, within the token budget
+        index = self.indexes.get(book) or self._open_built(book)
+        if index is None:
+            return None
+        ranked = index.search(question, self.passages)
+        selected, budget = [], self.max_tokens * 4  # ~4 characters per token
+        for chunk_id, _ in ranked:
+            text = index.chunk(chunk_id)
+            if len(text) > budget:
+                continue
+            selected.append((chunk_id, text))
+            budget -= len(text)
+        if not selected:
+            return None
+        return "\n\n".join(f"[Фрагмент {chunk_id + 1}]\n{text}" for chunk_id, text in sorted(selected))
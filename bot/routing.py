@@ -0,0 +1,98 @@
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from bot.catalog import get_catalog
+from bot.conversation import Conversation
+from bot.key_pool import KeyPool
+from bot.metrics import MODEL_ROUTES
+
+FAST = "fast"
+THINKING = "thinking"
+AUTO = "auto"
+TIERS = (FAST, THINKING)
+
+# Words that usually ask for reasoning rather than a summary
+_COMPLEX = re.compile(
+    r"почему|зачем|сравни|сопостав|объясни|обоснуй|докажи|проанализ|разбер|противореч|"
+    r"в ч[её]м разница|чем отлича|как связан|что будет, если|по шагам|пошагов|"
+    r"\b(why|compare|explain|analy[sz]e|contradict|step by step|what if)\b",
+    re.IGNORECASE,
+)
+
+
+def complexity(question: str, min_chars: int) -> int:
+    # Rough score: long questions, reasoning words and several questions in one message
+    score = 0
+    if len(question) >= min_chars:
+        score += 1
+    score += min(2, len(_COMPLEX.findall(question)))
+    if question.count("?") >= 2:
+        score += 1
+    return score
+
+
+# Picks the model for each question. Simple questions go to the fast model; reasoning-heavy
+# ones, or books configured for it, go to the thinking model unless its keys are saturated.
+class ModelRouter:
+    def __init__(self, pools: Dict[str, KeyPool], mode: str = AUTO, min_chars: int = 300, min_score: int = 2,
+                 max_utilization: float = 0.8, max_wait: float = 2.0):
+        self.pools = pools
+        self.mode = mode
+        self.min_chars = min_chars
+        self.min_score = min_score
+        self.max_utilization = max_utilization
+        self.max_wait = max_wait  # Longest wait for a thinking key while the fast model is free
+        self.waiting = {tier: 0 for tier in pools}  # Questions waiting for a key of each model
+        self.stats = {tier: 0 for tier in pools}
+
+    def model_name(self, tier: str) -> str:
+        return self.pools[tier].model_name
+
+    def saturated(self, tier: str, tokens: int) -> bool:
+        # Questions already queue for this model, or every key is near its quota or would make us wait
+        pool = self.pools[tier]
+        if self.waiting[tier] >= len(pool):
+            return True
+        return all(
+            key.requests.utilization() >= self.max_utilization or key.wait_time(tokens) > self.max_wait
+            for key in pool.keys
+        )
+
+    def _wanted(self, book: str, question: str, history: Optional[Conversation]) -> Tuple[str, str]:
+        # (tier, reason) before looking at load
+        if self.mode != AUTO:
+            return self.mode, "config"
+        book_tier = get_catalog().model_tier(book)
+        if book_tier in TIERS:
+            return book_tier, "book"
+        text = question
+        if history and history.turns:
+            # A short follow-up to a question that needed reasoning is still part of that discussion
+            text = f"{history.turns[-1][0]}\n{question}"
+        if complexity(text, self.min_chars) >= self.min_score:
+            return THINKING, "complex"
+        return FAST, "simple"
+
+    def preferred_model(self, book: str, question: str, history: Optional[Conversation] = None) -> str:
+        # The model a question goes to when keys are free; cached answers are looked up under it
+        if len(self.pools) == 1:
+            return self.model_name(next(iter(self.pools)))
+        return self.model_name(self._wanted(book, question, history)[0])
+
+    def route(self, book: str, question: str, history: Optional[Conversation], tokens: int) -> List[str]:
+        # Tiers to try in order. The thinking model falls back to the fast one when it has no
+        # usable key; the fast model never falls back to the slower, scarcer thinking one.
+        if len(self.pools) == 1:
+            return list(self.pools)
+        tier, reason = self._wanted(book, question, history)
+        if tier == THINKING and self.saturated(THINKING, tokens) and not self.saturated(FAST, tokens):
+            logging.info(f"Thinking model saturated, answering with {self.model_name(FAST)}")
+            tier, reason = FAST, "saturated"
+        self.stats[tier] += 1
+        MODEL_ROUTES.inc(model=self.model_name(tier), reason=reason)
+        return [THINKING, FAST] if tier == THINKING else [FAST]
+
+    def report(self) -> Dict[str, Dict]:
+        return {self.model_name(tier): {"routed": self.stats[tier], "keys": pool.report()}
+                for tier, pool in self.pools.items()}
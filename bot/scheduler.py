@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+# Limits concurrent generations and serves queued users round-robin
+class GenerationScheduler:
+    def __init__(self, concurrency: int, max_queue: int = 100, position_interval: float = 5.0):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        # Seconds between queue position checks; the user is only notified when it changed
+        self.position_interval = position_interval
+        self.running = 0
+        self.queued = 0
+        self.queues: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+        self.stats = {"started": 0, "queued": 0, "shed": 0}
+
+    def position(self, user_id: int, waiter: asyncio.Future) -> int:
+        # Round-robin serves one job per user per turn, so a job at depth i waits for
+        # up to i+1 jobs from every other user
+        queue = self.queues.get(user_id)
+        if not queue or waiter not in queue:
+            return 0
+        depth = queue.index(waiter)
+        ahead = sum(min(len(other), depth + 1) for uid, other in self.queues.items() if uid != user_id)
+        return ahead + depth + 1
+
+    async def run(self, user_id: int, func: Callable[..., Awaitable[Any]], *args,
+                  on_queued: Optional[Callable[[int], Awaitable[Any]]] = None) -> Any:
+        if self.running < self.concurrency and not self.queued:
+            self.running += 1
+        else:
+            await self._wait_for_slot(user_id, on_queued)
+
+        self.stats["started"] += 1
+        try:
+            return await func(*args)
+        finally:
+            self._release()
+
+    async def _wait_for_slot(self, user_id: int, on_queued: Optional[Callable[[int], Awaitable[Any]]]):
+        if self.queued >= self.max_queue:
+            self.stats["shed"] += 1
+            raise SchedulerBusy(f"Generation queue is full ({self.max_queue})")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_id, deque()).append(waiter)
+        self.queued += 1
+        self.stats["queued"] += 1
+
+        try:
+            if on_queued is None:
+                await waiter
+                return
+            notified = None
+            while not waiter.done():
+                position = self.position(user_id, waiter)
+                if position != notified:
+                    notified = position
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        logging.warning(f"Queue position notification failed: {e}")
+                await asyncio.wait([waiter], timeout=self.position_interval)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was already handed to us; pass it on
+                self._release()
+            else:
+                self._discard(user_id, waiter)
+            raise
+
+    def _discard(self, user_id: int, waiter: asyncio.Future):
+        queue = self.queues.get(user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.queues[user_id]
+
+    def _release(self):
+        # Hand the slot to the next user in rotation, or free it
+        while self.queues:
+            user_id, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            del self.queues[user_id]
+            if queue:
+                self.queues[user_id] = queue  # Move the user to the back of the rotation
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "running": self.running, "queue_depth": self.queued, "users_waiting": len(self.queues)}
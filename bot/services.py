@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from argparse import Namespace
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Set
+
+from bot.catalog import BookCatalog, set_catalog
+from bot.feedback import FeedbackStore
+from bot.metrics import REGISTRY
+from bot.rate_limit import set_store, SQLiteStore
+from bot.scheduler import GenerationScheduler
+from bot.storage import SQLiteStorage
+
+if TYPE_CHECKING:
+    from bot.cache import ResponseCache
+    from bot.key_pool import KeyPool
+    from bot.routing import ModelRouter
+    from bot.outbox import EmailOutbox
+    from bot.retrieval import Retriever
+    from bot.gemini_handler import GeminiHandler
+
+SMTP_SERVER = "smtp.gmail.com"
+SMTP_PORT = 587
+
+
+# Services shared by handlers, built from one parsed configuration. Handlers get it as the
+# `services` argument through the dispatcher's workflow data. Anything that pulls in the
+# Gemini SDK, opens SMTP or scans book files is built on first use.
+class Services:
+    def __init__(self, args: Namespace, worker_index: int = 0, **overrides: Any):
+        self.args = args
+        self.worker_index = worker_index
+        # Instances passed in (e.g. a stub Gemini handler) win over lazily built ones
+        self.instances: Dict[str, Any] = dict(overrides)
+
+        set_catalog(BookCatalog(args.catalog))
+        if args.rate_limit_db:
+            set_store(SQLiteStore(args.rate_limit_db))
+
+        self.storage = SQLiteStorage(args.fsm_db, ttl=args.fsm_ttl, max_sessions=args.fsm_max_sessions,
+                                     shared=args.workers > 1)
+        self.feedback_store = FeedbackStore(args.feedback_path, rotate=worker_index == 0)
+        self.scheduler = GenerationScheduler(args.max_concurrency or 2 * len(args.gemini_api_keys),
+                                             max_queue=args.max_queue, position_interval=args.queue_position_interval)
+        # Running generations per user, so the cancel button can abort them
+        self.active_generations: Dict[int, asyncio.Task] = {}
+        self.handler_tasks: Set[asyncio.Task] = set()  # Updates being handled right now
+        self._register_gauges()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        if name not in self.instances:
+            self.instances[name] = factory()
+        return self.instances[name]
+
+    def built(self, name: str) -> Optional[Any]:
+        return self.instances.get(name)
+
+    @property
+    def response_cache(self) -> "ResponseCache":
+        return self._get("response_cache", self._build_response_cache)
+
+    @property
+    def key_pools(self) -> Dict[str, "KeyPool"]:
+        return self._get("key_pools", self._build_key_pools)
+
+    @property
+    def model_router(self) -> "ModelRouter":
+        return self._get("model_router", self._build_model_router)
+
+    @property
+    def retriever(self) -> Optional["Retriever"]:
+        return self._get("retriever", self._build_retriever)
+
+    @property
+    def gemini_handler(self) -> "GeminiHandler":
+        return self._get("gemini_handler", self._build_gemini_handler)
+
+    @property
+    def email_outbox(self) -> Optional["EmailOutbox"]:
+        return self._get("email_outbox", self._build_email_outbox)
+
+    def _build_response_cache(self) -> "ResponseCache":
+        from bot.cache import ResponseCache
+        args = self.args
+        cache = ResponseCache(ttl=args.cache_ttl, max_bytes=args.cache_max_bytes, db_path=args.cache_db)
+        cache.purge_stale_versions()
+        return cache
+
+    def _build_key_pools(self) -> Dict[str, "KeyPool"]:
+        # Quotas are per key and model, so each model gets its own pool over the same keys.
+        # Every webhook worker has its own pools, so each gets an equal share of the quotas.
+        from bot.key_pool import KeyPool
+        from bot.routing import FAST, THINKING
+        args = self.args
+        workers = max(1, args.workers)
+
+        def share(limit: int) -> int:
+            return max(1, limit // workers)
+
+        pools = {FAST: KeyPool(args.gemini_api_keys, args.fast_model, rpm=share(args.gemini_rpm),
+                               tpm=share(args.gemini_tpm), strategy=args.key_strategy)}
+        if args.thinking_model != args.fast_model:
+            pools[THINKING] = KeyPool(args.gemini_api_keys, args.thinking_model,
+                                      rpm=share(args.thinking_rpm or args.gemini_rpm), tpm=share(args.gemini_tpm),
+                                      strategy=args.key_strategy)
+        return pools
+
+    def _build_model_router(self) -> "ModelRouter":
+        from bot.routing import ModelRouter
+        args = self.args
+        return ModelRouter(self.key_pools, mode=args.model_routing, min_chars=args.thinking_min_chars,
+                           max_utilization=args.thinking_max_utilization, max_wait=args.thinking_max_wait)
+
+    def _build_retriever(self) -> Optional["Retriever"]:
+        if not self.args.books_dir:
+            return None
+        from bot.retrieval import Retriever
+        args = self.args
+        return Retriever(args.books_dir, args.index_dir, passages=args.context_passages, max_tokens=args.context_tokens)
+
+    def _build_gemini_handler(self) -> "GeminiHandler":
+        from bot.gemini_handler import GeminiHandler
+        args = self.args
+        logging.info("Loading Gemini client")
+        return GeminiHandler(args.gemini_api_keys, cache=self.response_cache, router=self.model_router,
+                             mode=args.gemini_mode, timeout=args.gemini_timeout,
+                             executor_workers=args.executor_workers, retriever=self.retriever,
+                             hedge=args.hedge, hedge_ratio=args.hedge_ratio,
+                             timeout_factor=args.timeout_factor, min_timeout=args.min_timeout)
+
+    def _build_email_outbox(self) -> Optional["EmailOutbox"]:
+        args = self.args
+        if not (args.gmail_login and args.gmail_app_password and args.receivers_email):
+            return None
+        from bot.outbox import EmailOutbox
+        outbox = EmailOutbox(
+            SMTP_SERVER, SMTP_PORT, args.gmail_login, args.gmail_app_password, args.receivers_email,
+            db_path=args.outbox_db, digest_size=args.email_digest_size, digest_interval=args.email_digest_minutes * 60
+        )
+        # Several webhook workers share the outbox; only the first one delivers
+        outbox.delivery_enabled = self.worker_index == 0
+        return outbox
+
+    def _register_gauges(self):
+        # Services that were never built report nothing instead of being built by a scrape
+        def keys(value: Callable[[Any], float]) -> Callable[[], Dict]:
+            def collect():
+                pools = self.built("key_pools") or {}
+                return {(pool.model_name, k.name): value(k) for pool in pools.values() for k in pool.keys}
+            return collect
+
+        def gemini_in_flight():
+            handler = self.built("gemini_handler")
+            return len(getattr(handler, "in_flight", ())) if handler is not None else 0
+
+        def outbox_pending():
+            outbox = self.built("email_outbox")
+            return outbox.pending if outbox is not None else 0
+
+        REGISTRY.gauge("bot_active_generations", "Answers being generated for users",
+                       lambda: len(self.active_generations))
+        REGISTRY.gauge("bot_scheduler_running", "Generations holding a scheduler slot", lambda: self.scheduler.running)
+        REGISTRY.gauge("bot_scheduler_queue_depth", "Questions waiting for a generation slot",
+                       lambda: self.scheduler.queued)
+        REGISTRY.gauge("bot_gemini_in_flight", "Distinct upstream Gemini requests in flight", gemini_in_flight)
+        REGISTRY.gauge("bot_gemini_key_in_flight", "Requests in flight per API key",
+                       keys(lambda k: k.in_flight), ("model", "key"))
+        REGISTRY.gauge("bot_gemini_key_rpm_utilization", "Share of the per-minute request quota in use per API key",
+                       keys(lambda k: k.requests.utilization()), ("model", "key"))
+        REGISTRY.gauge("bot_gemini_key_cooldown_seconds", "Remaining cooldown per API key",
+                       keys(lambda k: k.report()["cooldown"]), ("model", "key"))
+        REGISTRY.gauge("bot_feedback_queue_depth", "Feedback records waiting to be written",
+                       lambda: self.feedback_store.queue.qsize() if self.feedback_store.queue is not None else 0)
+        REGISTRY.gauge("bot_outbox_pending", "Feedback emails waiting for delivery", outbox_pending)
+        REGISTRY.gauge("bot_fsm_hot_sessions", "Conversations cached in memory",
+                       lambda: self.storage.get_stats()["hot_sessions"])
+        REGISTRY.gauge("bot_fsm_dirty_sessions", "Conversation changes waiting to be flushed",
+                       lambda: self.storage.get_stats()["dirty"])
+
+    async def start(self):
+        # Background work that must run in exactly one process
+        if self.worker_index == 0 and self.retriever is not None:
+            # Only books whose text changed since the last run are re-indexed
+            await asyncio.to_thread(self.retriever.build_all)
+        if self.email_outbox is not None:
+            self.email_outbox.start()  # Resume emails left pending by a previous run
+
+    async def drain(self):
+        # Lets running handlers finish their answers; whatever outlives the timeout is cancelled
+        tasks = self.handler_tasks - {asyncio.current_task()}
+        if not tasks:
+            return
+        logging.info(f"Waiting for {len(tasks)} running handlers")
+        _, pending = await asyncio.wait(tasks, timeout=self.args.shutdown_timeout)
+        if pending:
+            logging.warning(f"Cancelling {len(pending)} handlers still running after {self.args.shutdown_timeout}s")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        # Call after the dispatcher's shutdown, which drains handlers and closes the FSM storage
+        await self.feedback_store.close()
+        outbox = self.built("email_outbox")
+        if outbox is not None:
+            await outbox.close()
+        handler = self.built("gemini_handler")
+        if handler is not None and hasattr(handler, "close"):
+            handler.close()
+        cache = self.built("response_cache")
+        if cache is not None:
+            cache.close()
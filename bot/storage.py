@@ -0,0 +1,238 @@
+import time
+import json
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from bot.metrics import span
+
+REF_MARKER = "$ref"
+
+
+def key_to_str(key: StorageKey) -> str:
+    business_id = getattr(key, "business_connection_id", None) or ""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{business_id}:{key.destiny}"
+
+
+class Session:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.touched = time.monotonic()
+
+
+# FSM storage: hot sessions in memory with idle TTL, persisted to SQLite in batches
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str, ttl: float = 3600, max_sessions: int = 10_000,
+                 flush_interval: float = 2.0, batch_size: int = 500,
+                 large_fields: Iterable[str] = ("response",), large_field_threshold: int = 256,
+                 persist_ttl: float = 7 * 24 * 3600, shared: bool = False):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.large_fields = set(large_fields)
+        self.large_field_threshold = large_field_threshold
+        self.persist_ttl = persist_ttl
+        # Several processes on one database: no hot cache, every change written through
+        self.shared = shared
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.dirty: Dict[str, Optional[Session]] = {}  # None marks a deleted session
+        self.flushing: Dict[str, Optional[Session]] = {}  # Taken from `dirty`, not yet committed
+        self.flusher: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, refs TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+        self._collect_garbage()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        session = await self._session(key)
+        session.state = state.state if isinstance(state, State) else state
+        await self._persist(key_to_str(key), session)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        session = await self._session(key)
+        session.data = data.copy()
+        await self._persist(key_to_str(key), session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(key)).data.copy()
+
+    async def close(self) -> None:
+        in_flight = list(self.flushing.items())
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        # A cancelled flush may not have committed; write its batch again together with the rest
+        batch = dict(in_flight)
+        batch.update(self._take_batch(len(self.dirty)))
+        await self._flush(list(batch.items()))
+        self.db.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hot_sessions": len(self.sessions), "dirty": len(self.dirty) + len(self.flushing)}
+
+    async def _session(self, key: StorageKey) -> Session:
+        key_str = key_to_str(key)
+        if self.shared:
+            return await asyncio.to_thread(self._load, key_str)
+        session = self.sessions.get(key_str)
+        if session is None:
+            # Unsaved changes, including a batch being written right now, are newer than SQLite
+            pending = self.dirty.get(key_str, ...)
+            if pending is ...:
+                pending = self.flushing.get(key_str, ...)
+            if pending is not ...:
+                session = pending or Session(None, {})
+            else:
+                session = await asyncio.to_thread(self._load, key_str)
+                # Another update may have loaded the same session meanwhile
+                session = self.sessions.get(key_str, session)
+            self.sessions[key_str] = session
+            self._evict()
+        else:
+            self.sessions.move_to_end(key_str)
+        session.touched = time.monotonic()
+        return session
+
+    def _evict(self):
+        # Idle or overflowing sessions leave memory; SQLite keeps them (unflushed ones stay in `dirty` or `flushing`)
+        now = time.monotonic()
+        while self.sessions:
+            key_str, oldest = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and now - oldest.touched < self.ttl:
+                break
+            del self.sessions[key_str]
+
+    async def _persist(self, key_str: str, session: Session):
+        if not self.shared:
+            self._mark_dirty(key_str, session)
+            return
+        empty = session.state is None and not session.data
+        await asyncio.to_thread(self._write_batch, [(key_str, None if empty else session)])
+
+    def _mark_dirty(self, key_str: str, session: Session):
+        if session.state is None and not session.data:
+            self.sessions.pop(key_str, None)
+            self.dirty[key_str] = None
+        else:
+            self.dirty[key_str] = session
+
+        if self.flusher is None:
+            self.wakeup = asyncio.Event()
+            self.flusher = asyncio.create_task(self._flush_loop())
+        if len(self.dirty) >= self.batch_size:
+            self.wakeup.set()
+
+    async def _flush_loop(self):
+        gc_every = max(1, int(3600 / self.flush_interval))
+        rounds = 0
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self._evict()
+            try:
+                while self.dirty:
+                    await self._flush(self._take_batch(self.batch_size))
+                rounds += 1
+                if rounds % gc_every == 0:
+                    await asyncio.to_thread(self._collect_garbage)
+            except Exception as e:
+                logging.exception(f"FSM storage flush failed: {e}")
+
+    def _take_batch(self, size: int) -> List[Tuple[str, Optional[Session]]]:
+        batch = []
+        for key_str in list(self.dirty)[:size]:
+            session = self.dirty.pop(key_str)
+            self.flushing[key_str] = session
+            batch.append((key_str, session))
+        return batch
+
+    async def _flush(self, batch: List[Tuple[str, Optional[Session]]]):
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+        except Exception:
+            # Nothing was committed: queue the batch again unless the sessions changed meanwhile
+            for key_str, session in batch:
+                self.dirty.setdefault(key_str, session)
+            raise
+        finally:
+            for key_str, session in batch:
+                if self.flushing.get(key_str, ...) is session:
+                    del self.flushing[key_str]
+
+    def _write_batch(self, batch: List[Tuple[str, Optional[Session]]]):
+        if not batch:
+            return
+        now = time.time()
+        rows, blobs, deleted = [], [], []
+        for key_str, session in batch:
+            if session is None:
+                deleted.append((key_str,))
+                continue
+            data, refs = {}, []
+            for field, value in session.data.items():
+                # Large texts are stored once, content-addressed, and referenced from the snapshot
+                if field in self.large_fields and isinstance(value, str) and len(value) >= self.large_field_threshold:
+                    digest = hashlib.sha1(value.encode("utf-8")).hexdigest()
+                    blobs.append((digest, value))
+                    refs.append(digest)
+                    value = {REF_MARKER: digest}
+                data[field] = value
+            rows.append((key_str, session.state, json.dumps(data, ensure_ascii=False), json.dumps(refs), now))
+
+        with span("fsm_flush"), self.lock:
+            try:
+                self.db.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?)", blobs)
+                self.db.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)", rows)
+                self.db.executemany("DELETE FROM sessions WHERE key = ?", deleted)
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def _load(self, key_str: str) -> Session:
+        with span("fsm_load"), self.lock:
+            row = self.db.execute("SELECT state, data FROM sessions WHERE key = ?", (key_str,)).fetchone()
+            if row is None:
+                return Session(None, {})
+            data = json.loads(row[1])
+            for field, value in data.items():
+                if isinstance(value, dict) and REF_MARKER in value:
+                    blob = self.db.execute("SELECT value FROM blobs WHERE hash = ?", (value[REF_MARKER],)).fetchone()
+                    data[field] = blob[0] if blob else None
+        return Session(row[0], data)
+
+    def _collect_garbage(self):
+        with self.lock:
+            self.db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.persist_ttl,))
+            self.db.execute(
+                "DELETE FROM blobs WHERE hash NOT IN (SELECT value FROM sessions, json_each(sessions.refs))"
+            )
+            self.db.commit()
@@ -1,46 +1,132 @@
+import os
+import signal
 import asyncio
-import nest_asyncio
 import logging
-from aiogram import Bot, Dispatcher
-from bot.config import parse_args
-from bot.middlewares import RateLimiter, ErrorHandlerMiddleware
-from bot.handlers import basic, question
+import multiprocessing
+from argparse import Namespace
 
-from aiogram import Router, types, F
-from aiogram.filters import Command
-from bot.states import QuestionState
-from bot.middlewares import RateLimiter
+from bot.config import parse_args
+from bot.bootstrap import create_app
+from bot.metrics import serve_metrics
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-args = parse_args()
-bot = Bot(token=args.telegram_token)
-dp = Dispatcher()
-
-dp.message.middleware(ErrorHandlerMiddleware())
 
-dp.include_router(basic.basic_router)
-dp.include_router(question.question_router)
+async def startup(args: Namespace, services):
+    metrics_runner = None
+    if args.metrics_port is not None:
+        metrics_runner = await serve_metrics(args.metrics_host, args.metrics_port + services.worker_index)
+    await services.start()
+    return metrics_runner
 
-@dp.message(Command("stop"), RateLimiter(limit=3, period=60))
-async def stop_bot(message: types.Message):
-    try:
-        await message.answer("Бот завершает работу. До свидания!")
-        await dp.stop_polling()
-        logging.info("Bot stopped")
-    except Exception as e:
-        logging.exception(f"Error in /stop: {e}")
+async def shutdown(services, metrics_runner):
+    # The dispatcher's shutdown has already drained handlers and closed the FSM storage and bot session
+    await services.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    logging.info("Bot has shut down")
 
-async def main():
+async def main(args: Namespace):
+    bot, dp, services = create_app(args)
+    metrics_runner = None
     try:
         logging.info("Starting bot...")
+        metrics_runner = await startup(args, services)
         await dp.start_polling(bot)
     except Exception as e:
         logging.exception(f"Error in main loop: {e}")
+    finally:
+        await shutdown(services, metrics_runner)
+
+async def serve_webhook(args: Namespace, worker_index: int):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    bot, dp, services = create_app(args, worker_index=worker_index)
+    app = web.Application()
+    # Telegram gets its 200 right away; handlers run as background tasks
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=args.webhook_secret, handle_in_background=True
+    ).register(app, path=args.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    metrics_runner = None
+    try:
+        metrics_runner = await startup(args, services)
+        site = web.TCPSite(runner, args.host, args.port, reuse_port=args.workers > 1)
+        await site.start()
+        logging.info(f"Webhook worker {worker_index} listening on {args.host}:{args.port}{args.webhook_path}")
+        # docker stop / systemd send SIGTERM; stop cleanly so queued feedback and emails are flushed
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+        logging.info(f"Webhook worker {worker_index} stopping")
+        # Stop taking updates, then let running handlers finish while the bot session is still open:
+        # the request handler closes it on cleanup, before the dispatcher's own shutdown runs
+        await site.stop()
+        await services.drain()
+    finally:
+        await runner.cleanup()
+        await shutdown(services, metrics_runner)
+
+async def register_webhook(args: Namespace):
+    from aiogram import Bot
+
+    bot = Bot(token=args.telegram_token)
+    try:
+        await bot.set_webhook(args.webhook_url.rstrip("/") + args.webhook_path, secret_token=args.webhook_secret)
+        logging.info("Webhook registered")
     finally:
         await bot.session.close()
-        logging.info("Bot has shut down")
+
+def run_webhook_worker(args: Namespace, worker_index: int = 0):
+    try:
+        asyncio.run(serve_webhook(args, worker_index))
+    except KeyboardInterrupt:
+        pass
+
+# Limits of --workers N: each worker is a separate process with its own
+# - Gemini key pools: every worker gets 1/N of --gemini-rpm/--gemini-tpm per key, so a busy worker
+#   can't borrow quota an idle one leaves unused;
+# - answer cache (unless --cache-db is shared) and coalescing of identical questions;
+# - running generations: the cancel button only works when Telegram delivers its callback to the
+#   worker that runs the generation, otherwise the answer completes.
+# Rate limits (--rate-limit-db), conversation state, the outbox and the feedback log are shared.
+def run_webhook(args: Namespace):
+    asyncio.run(register_webhook(args))
+    if args.workers == 1:
+        run_webhook_worker(args)
+        return
+
+    logging.info(f"Starting {args.workers} webhook workers; each uses 1/{args.workers} of the Gemini quotas")
+    # Spawned workers get the parsed arguments and build their own services and connections
+    context = multiprocessing.get_context("spawn")
+    workers = []
+
+    def forward(signum, frame):
+        # Each worker drains its queues on SIGTERM/SIGINT; the parent waits for them below
+        for process in workers:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for index in range(args.workers):
+        process = context.Process(target=run_webhook_worker, args=(args, index))
+        process.start()
+        workers.append(process)
+    for process in workers:
+        process.join()
 
 if __name__ == "__main__":
-    nest_asyncio.apply()
-    asyncio.run(main())
+    args = parse_args()
+    if args.mode == "webhook":
+        run_webhook(args)
+    else:
+        import nest_asyncio
+        nest_asyncio.apply()
+        asyncio.run(main(args))
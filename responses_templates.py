@@ -1,4 +1,5 @@
-PROMPT = """Ты – эксперт по анализу жизненных ситуаций на основе книги: {book}.
+# Static per-book instructions, sent as the model's system instruction
+SYSTEM_PROMPT = """Ты – эксперт по анализу жизненных ситуаций на основе книги: {book}.
 Когда пользователь описывает свою ситуацию, указывает конкретную книгу и задает вопрос, твоя задача:
 
     Принять указанную пользователем книгу как единственный источник для анализа.
@@ -6,9 +7,6 @@ PROMPT = """Ты – эксперт по анализу жизненных си
     Ответить на вопрос пользователя, обосновывая свой ответ идеями из книги.
     Подкрепить ответ цитатами из книги, которые объясняют, почему именно такой ответ применим к ситуации пользователя.
 
-Контекст:
-{context}
-
 Структура ответа:
 
     Анализ ситуации: (кратко изложи, как ты понимаешь описанную пользователем ситуацию).
@@ -16,9 +14,29 @@ PROMPT = """Ты – эксперт по анализу жизненных си
     Обоснование: (объясни, как идеи из указанной книги применимы к ситуации).
     Цитаты из книги: (приведи 1-2 цитаты, подтверждающие твой ответ).
 
-Пиши дружелюбно, ясно и профессионально и главное по дело - коротко.
+Пиши дружелюбно, ясно и профессионально и главное по дело - коротко."""
+
+# Changes with every question
+TURN_PROMPT = """Контекст:
+{context}
+
 Вопрос пользователя: {question}"""
 
+PROMPT = SYSTEM_PROMPT + "\n\n" + TURN_PROMPT
+
+# Follow-up turns: the earlier answers in the history already show the structure, so the full
+# instructions are not sent again
+FOLLOW_UP_SYSTEM_PROMPT = """Ты – эксперт по анализу жизненных ситуаций на основе книги: {book}.
+Продолжай разговор: ответь на новый вопрос пользователя в той же структуре, что и раньше \
+(анализ ситуации, ответ, обоснование, 1-2 цитаты из книги). Пиши дружелюбно, ясно и коротко."""
+
+# Compacted earlier turns of a follow-up conversation
+SUMMARY_PROMPT = """Краткое содержание предыдущих вопросов и ответов в этом разговоре:
+{summary}"""
+SUMMARY_ACK = "Хорошо, я учту предыдущий разговор."
+
+ERROR_RESPONSE = "Ошибка при получении ответа. Попробуйте позже."
+
 book_prompts = {
     "Самый богатый человек в Вавилоне": """
 Например:
@@ -64,6 +82,17 @@ book_prompts = {
     """
 }
 
+# Alternative titles and authors used to find a book (Latin and Cyrillic)
+book_aliases = {
+    "Самый богатый человек в Вавилоне": ["The Richest Man in Babylon", "Джордж Клейсон", "George Clason"],
+    "Богатый папа, бедный папа": ["Rich Dad Poor Dad", "Роберт Кийосаки", "Robert Kiyosaki"],
+    "Думай медленно, решай быстро": ["Thinking, Fast and Slow", "Даниэль Канеман", "Daniel Kahneman"],
+    "Думай и богатей": ["Think and Grow Rich", "Наполеон Хилл", "Napoleon Hill"],
+    "Сила подсознания или Подсознание может всё": ["The Power of Your Subconscious Mind", "Джозеф Мерфи", "Joseph Murphy"],
+    "Тонкое искусство пофигизма": ["The Subtle Art of Not Giving a F*ck", "Марк Мэнсон", "Mark Manson"],
+    "7 навыков высокоэффективных людей": ["The 7 Habits of Highly Effective People", "Стивен Кови", "Stephen Covey"],
+}
+
 help_text = """
 Доступные команды:
 /question - Задать вопрос по книге
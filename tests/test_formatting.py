@@ -0,0 +1,44 @@
+# Markdown to Telegram HTML rendering and message splitting
+from bot.formatting import render_chunks, render_html, text_length, visible_length
+from bot.message_editor import MAX_PREVIEW_LENGTH, ThrottledEditor
+
+
+def test_header_keeps_inline_markup():
+    assert render_html("# Title **bold**") == "<b>Title <b>bold</b></b>"
+    assert render_html("### Заголовок ###") == "<b>Заголовок</b>"
+
+
+def test_bold_italic():
+    assert render_html("***x***") == "<b><i>x</i></b>"
+    assert render_html("**жирный** и *курсив*") == "<b>жирный</b> и <i>курсив</i>"
+
+
+def test_identifiers_with_underscores_stay_literal():
+    assert render_html("__init__") == "__init__"
+    assert render_html("вызовите __init__ родителя") == "вызовите __init__ родителя"
+    assert render_html("self.__init__()") == "self.__init__()"
+    assert render_html("snake_case_name") == "snake_case_name"
+    assert render_html("это __очень важно__ и _это_ тоже") == "это <b>очень важно</b> и <i>это</i> тоже"
+
+
+def test_chunks_fit_in_utf16_units():
+    for text in ("😀" * 5000, ("😀" * 3 + " ") * 3000, "а" * 9000):
+        chunks = render_chunks(text)
+        assert all(visible_length(chunk) <= 4096 for chunk in chunks)
+        assert "".join(chunks).replace(" ", "") == text.replace(" ", "")
+
+
+class EditedMessage:
+    text = ""
+
+    async def edit_text(self, text, parse_mode=None, reply_markup=None):
+        self.text = text
+
+
+def test_preview_is_cut_by_utf16_length():
+    import asyncio
+
+    message = EditedMessage()
+    asyncio.run(ThrottledEditor(message, interval=0).update("😀" * 3000))
+    assert text_length(message.text) <= MAX_PREVIEW_LENGTH + 1
+    assert message.text.endswith("…")
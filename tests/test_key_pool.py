@@ -0,0 +1,63 @@
+# Per-key Gemini clients bound through GenerativeModel's private attributes
+import asyncio
+import warnings
+
+import pytest
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", FutureWarning)  # The SDK warns on import that it is deprecated
+    genai = pytest.importorskip("google.generativeai")
+
+from bot.key_pool import GENAI_SDK_VERSION, ApiKey, bind_clients
+
+
+class Sent(Exception):
+    pass
+
+
+class RecordingClient:
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        raise Sent()
+
+
+class RecordingAsyncClient(RecordingClient):
+    async def generate_content(self, request, **kwargs):
+        return super().generate_content(request, **kwargs)
+
+
+def test_installed_sdk_is_the_pinned_one():
+    # Bump GENAI_SDK_VERSION only after checking bind_clients against the new release
+    assert genai.__version__ == GENAI_SDK_VERSION
+
+
+def test_model_still_has_the_client_attributes():
+    model = genai.GenerativeModel("gemini-1.5-flash")
+    assert model._client is None and model._async_client is None
+    bind_clients(model, "client", "async client")
+    assert (model._client, model._async_client) == ("client", "async client")
+
+
+def test_missing_attributes_fail_loudly():
+    class Renamed:
+        pass
+
+    with pytest.raises(RuntimeError, match="_client"):
+        bind_clients(Renamed(), None, None)
+
+
+def test_requests_go_through_the_key_client():
+    key = ApiKey("AIza-test-key-0001", "gemini-1.5-flash", rpm=10, tpm=1000)
+    key.client, key.async_client = RecordingClient(), RecordingAsyncClient()
+    model = key.get_model("gemini-1.5-flash", "Отвечай кратко")
+
+    with pytest.raises(Sent):
+        model.generate_content("Вопрос")
+    with pytest.raises(Sent):
+        asyncio.run(model.generate_content_async("Вопрос"))
+    assert len(key.client.requests) == 1 and len(key.async_client.requests) == 1
+    assert key.async_client.requests[0].system_instruction.parts[0].text == "Отвечай кратко"
+    assert key.get_model("gemini-1.5-flash", "Отвечай кратко") is model
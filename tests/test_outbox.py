@@ -0,0 +1,178 @@
+# EmailOutbox against a local aiosmtpd server standing in for Gmail
+import time
+import email
+import socket
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult, LoginPassword
+
+from bot.outbox import EmailOutbox
+
+LOGIN, PASSWORD, RECEIVER = "bot@example.com", "app-password", "owner@example.com"
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def authenticate(server, session, envelope, mechanism, auth_data):
+    ok = isinstance(auth_data, LoginPassword) and auth_data.login.decode() == LOGIN \
+        and auth_data.password.decode() == PASSWORD
+    return AuthResult(success=ok)
+
+
+def message_text(envelope) -> str:
+    message = email.message_from_bytes(envelope.content)
+    return "".join(part.get_payload(decode=True).decode("utf-8") for part in message.walk()
+                   if part.get_content_type() == "text/plain")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port(),
+                            authenticator=authenticate, auth_require_tls=False)
+    controller.start()
+    yield controller, inbox
+    controller.stop()
+
+
+def make_outbox(controller, tmp_path, **kwargs) -> EmailOutbox:
+    return EmailOutbox(controller.hostname, controller.port, LOGIN, PASSWORD, RECEIVER,
+                       db_path=str(tmp_path / "outbox.sqlite"), poll_interval=0.05, starttls=False, **kwargs)
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the outbox")
+        await asyncio.sleep(0.02)
+
+
+def test_sends_each_message_and_deletes_it(smtp_server, tmp_path):
+    controller, inbox = smtp_server
+
+    async def scenario():
+        outbox = make_outbox(controller, tmp_path)
+        for index in range(3):
+            await outbox.enqueue(f"Отзыв {index}", f"Комментарий {index}")
+        await wait_for(lambda: len(inbox.messages) == 3)
+        await wait_for(lambda: outbox.stats["sent_messages"] == 3)  # Marked sent after the server replied
+        assert await outbox.pending_count() == 0
+        assert await asyncio.to_thread(lambda: outbox.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]) == 0
+        assert outbox.stats["connections"] == 1  # One connection reused for all emails
+        await outbox.close()
+
+    asyncio.run(scenario())
+    assert all(envelope.rcpt_tos == [RECEIVER] for envelope in inbox.messages)
+
+
+def test_digest_waits_for_a_full_batch_without_interval(smtp_server, tmp_path):
+    controller, inbox = smtp_server
+
+    async def scenario():
+        outbox = make_outbox(controller, tmp_path, digest_size=5)
+        for index in range(3):
+            await outbox.enqueue(f"Отзыв {index}", f"Комментарий {index}")
+        await asyncio.sleep(0.3)
+        assert inbox.messages == []
+        assert await outbox.pending_count() == 3
+
+        for index in range(3, 5):
+            await outbox.enqueue(f"Отзыв {index}", f"Комментарий {index}")
+        await wait_for(lambda: len(inbox.messages) == 1)
+        await wait_for(lambda: outbox.stats["sent_messages"] == 5)
+        assert await outbox.pending_count() == 0
+        await outbox.close()
+
+    asyncio.run(scenario())
+    body = message_text(inbox.messages[0])
+    assert all(f"Комментарий {index}" in body for index in range(5))
+
+
+def test_digest_interval_flushes_a_partial_batch(smtp_server, tmp_path):
+    controller, inbox = smtp_server
+
+    async def scenario():
+        outbox = make_outbox(controller, tmp_path, digest_size=5, digest_interval=0.3)
+        for index in range(2):
+            await outbox.enqueue(f"Отзыв {index}", f"Комментарий {index}")
+        await asyncio.sleep(0.1)
+        assert inbox.messages == []
+        await wait_for(lambda: len(inbox.messages) == 1)
+        await wait_for(lambda: outbox.stats["sent_messages"] == 2)
+        await outbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_delivery_is_retried(tmp_path):
+    async def scenario():
+        # Nothing listens on this port until the server starts below
+        port = free_port()
+        outbox = EmailOutbox("127.0.0.1", port, LOGIN, PASSWORD, RECEIVER, db_path=str(tmp_path / "outbox.sqlite"),
+                             poll_interval=0.05, base_delay=0.2, starttls=False)
+        await outbox.enqueue("Отзыв", "Комментарий")
+        await wait_for(lambda: outbox.stats["failures"] == 1)
+        assert await outbox.pending_count() == 1
+
+        inbox = Inbox()
+        controller = Controller(inbox, hostname="127.0.0.1", port=port,
+                                authenticator=authenticate, auth_require_tls=False)
+        controller.start()
+        try:
+            await wait_for(lambda: len(inbox.messages) == 1)
+            await wait_for(lambda: outbox.stats["sent_messages"] == 1)
+            assert await outbox.pending_count() == 0
+        finally:
+            await outbox.close()
+            controller.stop()
+
+    asyncio.run(scenario())
+
+
+class RejectingInbox(Inbox):
+    def __init__(self):
+        super().__init__()
+        self.recipients = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.recipients += 1
+        return "550 Mailbox unavailable"
+
+
+def test_refused_recipient_backs_off_without_reconnecting(tmp_path):
+    async def scenario():
+        inbox = RejectingInbox()
+        controller = Controller(inbox, hostname="127.0.0.1", port=free_port(),
+                                authenticator=authenticate, auth_require_tls=False)
+        controller.start()
+        try:
+            outbox = make_outbox(controller, tmp_path, base_delay=60)
+            await outbox.enqueue("Отзыв", "Комментарий")
+            await wait_for(lambda: outbox.stats["failures"] == 1)
+            await asyncio.sleep(0.2)
+            assert inbox.recipients == 1  # Not resent right away on a fresh connection
+            assert outbox.stats["connections"] == 1
+            assert await outbox.pending_count() == 1
+            await outbox.close()
+        finally:
+            controller.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+# Queue position notifications of GenerationScheduler
+import asyncio
+
+from bot.scheduler import GenerationScheduler
+
+
+def test_queued_user_is_told_when_their_position_changes():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1, position_interval=0.02)
+        releases = [asyncio.Event() for _ in range(3)]
+        positions = []
+
+        async def job(index: int):
+            await releases[index].wait()
+
+        async def notify(position: int):
+            positions.append(position)
+
+        running = [asyncio.ensure_future(scheduler.run(user_id, job, user_id)) for user_id in range(3)]
+        await asyncio.sleep(0.05)
+        last = asyncio.ensure_future(scheduler.run(3, asyncio.sleep, 0, on_queued=notify))
+        await asyncio.sleep(0.1)
+        assert positions == [3]  # Not repeated while nothing moves
+
+        for index, release in enumerate(releases):
+            release.set()
+            await running[index]
+            await asyncio.sleep(0.1)
+        await last
+        return positions
+
+    assert asyncio.run(scenario()) == [3, 2, 1]